@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, ForeignKey, Float, Boolean
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, ForeignKey, Float, Boolean, LargeBinary, BigInteger, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from sqlalchemy.sql import func
@@ -35,7 +35,8 @@ class Project(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     user = relationship("User", back_populates="projects")
-    images = relationship("Image", back_populates="project")
+    images = relationship("Image", back_populates="project", cascade="all, delete-orphan")
+    share = relationship("ProjectShare", back_populates="project", uselist=False, cascade="all, delete-orphan")
 
 
 class Image(Base):
@@ -47,10 +48,19 @@ class Image(Base):
     width = Column(Integer)
     height = Column(Integer)
     exif = Column(Text)  # JSON string
+    content_hash = Column(String(64), index=True)  # sha256 of the original file, for import dedup
+    phash = Column(BigInteger)  # 64-bit perceptual hash, see services/phash.py
+    phash_b0 = Column(Integer)  # its four 16-bit bands, for near-duplicate lookup
+    phash_b1 = Column(Integer)
+    phash_b2 = Column(Integer)
+    phash_b3 = Column(Integer)
     
     project = relationship("Project", back_populates="images")
-    masks = relationship("Mask", back_populates="image")
-    variants = relationship("Variant", back_populates="image")
+    masks = relationship("Mask", back_populates="image", cascade="all, delete-orphan")
+    variants = relationship("Variant", back_populates="image", cascade="all, delete-orphan")
+    
+    # Band lookups are always scoped to one user's projects; other users' rows are skipped in the index
+    __table_args__ = tuple(Index(f"ix_images_phash_b{i}_project", f"phash_b{i}", "project_id") for i in range(4))
 
 
 class Mask(Base):
@@ -60,6 +70,9 @@ class Mask(Base):
     image_id = Column(Integer, ForeignKey("images.id"), nullable=False)
     kind = Column(String, nullable=False)  # body, wheel, etc.
     url = Column(String, nullable=False)
+    data = Column(LargeBinary)  # compact RLE/bit-packed mask, see services/maskcodec.py
+    gc_state = Column(LargeBinary)  # 4-state GrabCut labels, kept for refinement
+    gc_models = Column(LargeBinary)  # bgd + fgd GMM models (130 float64)
     
     image = relationship("Image", back_populates="masks")
 
@@ -76,6 +89,20 @@ class Variant(Base):
     image = relationship("Image", back_populates="variants")
 
 
+class ProjectShare(Base):
+    __tablename__ = "project_shares"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    project_id = Column(Integer, ForeignKey("projects.id"), nullable=False, unique=True, index=True)
+    slug = Column(String, unique=True, index=True, nullable=False)
+    manifest_json = Column(Text, nullable=False)  # frozen snapshot served by GET /share/{slug}
+    etag = Column(String, nullable=False)
+    snapshot_version = Column(String)  # media/share/<slug>/<version>/ the manifest points at
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    project = relationship("Project", back_populates="share")
+
+
 class Asset(Base):
     __tablename__ = "assets"
     
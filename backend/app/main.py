@@ -1,9 +1,12 @@
+import os
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 
 from .routers import images, ops, auth, projects, catalog, share
-from .database import create_tables
+from .services import admission, executor, warmup
 
 
 def create_app() -> FastAPI:
@@ -21,6 +24,13 @@ def create_app() -> FastAPI:
 	def health():
 		return {"status": "ok"}
 
+	@app.get("/health/ready")
+	def health_ready():
+		# Load balancers should only route traffic once the worker is warm
+		if not warmup.is_ready():
+			return JSONResponse(status_code=503, content={"status": "warming", **warmup.status()})
+		return {"status": "ready", **warmup.status(), "ops": admission.scheduler.status()}
+
 	# Include all routers
 	app.include_router(auth.router, prefix="/api/v1/auth", tags=["auth"])
 	app.include_router(projects.router, prefix="/api/v1/projects", tags=["projects"])
@@ -30,15 +40,28 @@ def create_app() -> FastAPI:
 	app.include_router(share.router, prefix="/api/v1/share", tags=["share"])
 
 	# Serve uploaded media files
+	os.makedirs("media", exist_ok=True)
 	app.mount("/media", StaticFiles(directory="media"), name="media")
 
 	@app.on_event("startup")
 	async def startup_event():
-		# Create database tables on startup
-		create_tables()
+		# Schema changes are applied by `python -m app.migrate`; opt in here for local development only
+		if os.getenv("AUTO_MIGRATE", "0") == "1":
+			from .migrate import migrate
+			migrate()
+		if os.getenv("WARMUP_ON_STARTUP", "1") == "1":
+			warmup.start_background_warmup()
+		else:
+			warmup.mark_ready()
+		if os.getenv("MEDIA_GC_ENABLED", "0") == "1":
+			from .services.media_gc import start_background_gc
+			start_background_gc()
+
+	@app.on_event("shutdown")
+	async def shutdown_event():
+		executor.shutdown()
 
 	return app
 
 
 app = create_app()
-
@@ -0,0 +1,47 @@
+"""Explicit schema migration step.
+
+Run once per deploy, before any API worker starts taking traffic::
+
+    python -m app.migrate
+
+Creates missing tables and adds nullable columns / indexes that were added to
+the models after the table was first created.
+"""
+from typing import List
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from .database import Base, engine
+
+
+def migrate(bind: Engine = engine) -> List[str]:
+    applied: List[str] = []
+    Base.metadata.create_all(bind=bind)
+
+    inspector = inspect(bind)
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing_columns = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                column_type = column.type.compile(dialect=bind.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                applied.append(f"add column {table.name}.{column.name}")
+
+            existing_indexes = {ix["name"] for ix in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in existing_indexes:
+                    continue
+                index.create(bind=conn)
+                applied.append(f"create index {index.name}")
+
+    return applied
+
+
+if __name__ == "__main__":
+    changes = migrate()
+    for change in changes:
+        print(change)
+    print(f"schema up to date ({len(changes)} change(s) applied)")
@@ -1,19 +1,73 @@
 import os
 import uuid
 import json
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Form
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Form, Query
 from fastapi import status
 from typing import Dict, Any, Optional
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
-from ..services.storage import save_upload_file
-from ..database import get_db, Image, Project
+from ..services import detection_cache, phash
+from ..services.storage import UploadTooLarge, save_upload_file, save_upload_clip
+from ..database import get_db, Image, Project, Mask, Variant
 from ..services.auth import get_current_user, User
 
 
 router = APIRouter()
 
 
+def _find_duplicate(db: Session, image: Image, user_id: int) -> Optional[Dict[str, Any]]:
+    """The user's earlier copy of this photo: byte-identical first, else the closest same-size near-duplicate."""
+    if image.content_hash:
+        row = db.query(Image.id, Image.url).join(Project).filter(
+            Image.content_hash == image.content_hash,
+            Image.id != image.id,
+            Project.user_id == user_id
+        ).order_by(Image.id).first()
+        if row:
+            return {"image_id": row.id, "url": row.url, "distance": 0, "exact": True}
+    if image.phash is None:
+        return None
+    # Masks and detections are pixel coordinates, so only a same-size copy can take them over
+    for row, distance in phash.find_similar(db, image.phash, user_id, exclude_id=image.id, limit=5).matches:
+        if row.width == image.width and row.height == image.height:
+            return {"image_id": row.id, "url": row.url, "distance": distance, "exact": False}
+    return None
+
+
+def _reuse_derivatives(db: Session, image: Image, duplicate: Dict[str, Any]) -> Dict[str, Any]:
+    """Give ``image`` the masks (and, for exact copies, variants) of its duplicate instead of recomputing them."""
+    masks = [
+        Mask(image_id=image.id, kind=m.kind, url=m.url, data=m.data, gc_state=m.gc_state, gc_models=m.gc_models)
+        for m in db.query(Mask).filter(Mask.image_id == duplicate["image_id"]).order_by(Mask.id)
+    ]
+    variants = []
+    if duplicate["exact"]:
+        # Renders of other pixels would not match a near-duplicate exactly, so only exact copies share them
+        variants = [
+            Variant(image_id=image.id, description=v.description, url=v.url, layers_json=v.layers_json)
+            for v in db.query(Variant).filter(Variant.image_id == duplicate["image_id"]).order_by(Variant.id)
+        ]
+    db.add_all(masks + variants)
+    db.flush()
+    return {
+        "image_id": duplicate["image_id"],
+        "distance": duplicate["distance"],
+        "exact": duplicate["exact"],
+        "mask_ids": [m.id for m in masks],
+        "variant_ids": [v.id for v in variants],
+    }
+
+
+def _copy_detection(src_path: str, dst_path: str) -> None:
+    if src_path == dst_path:
+        # Same file: the detection sidecar is already shared
+        return
+    detection = detection_cache.get(src_path)
+    if detection is not None:
+        detection_cache.put(dst_path, detection)
+
+
 @router.post("")
 async def upload_image(
     file: UploadFile = File(...),
@@ -37,28 +91,64 @@ async def upload_image(
         if not project:
             raise HTTPException(status_code=404, detail="Project not found")
         
+        # Byte-identical file already in this user's projects: keep a single copy on disk
+        existing = db.query(Image.url).join(Project).filter(
+            Image.content_hash == meta["sha256"],
+            Project.user_id == current_user.id
+        ).first()
+        if existing and existing.url != path and os.path.exists(existing.url):
+            await run_in_threadpool(os.remove, path)
+            path = existing.url
+        
         # Save image record to database
         db_image = Image(
             project_id=project_id,
             url=path,
             width=meta.get("width"),
             height=meta.get("height"),
-            exif=json.dumps(meta) if meta else None
+            exif=json.dumps(meta) if meta else None,
+            content_hash=meta.get("sha256"),
+            **phash.columns(phash.from_hex(meta.get("phash")))
         )
         db.add(db_image)
+        db.flush()
+        
+        duplicate = _find_duplicate(db, db_image, current_user.id)
+        reused = _reuse_derivatives(db, db_image, duplicate) if duplicate else None
         db.commit()
         db.refresh(db_image)
+        if duplicate:
+            await run_in_threadpool(_copy_detection, duplicate["url"], path)
         
         return {
             "image_id": db_image.id,
             "image_path": path,
             "meta": meta,
-            "project_id": project_id
+            "project_id": project_id,
+            "duplicate_of": reused
         }
     
     return {"image_path": path, "meta": meta}
 
 
+@router.post("/clip")
+async def upload_clip(
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user),
+) -> Dict[str, Any]:
+    if not file.content_type or not file.content_type.startswith("video/"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Only video uploads are allowed")
+
+    # Clips are inputs for /ops/clip only; unused ones are reclaimed by the media GC
+    try:
+        path, meta = await save_upload_clip(file, subdir="clips")
+    except UploadTooLarge as exc:
+        raise HTTPException(status_code=413, detail=str(exc))
+    if meta is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unreadable video")
+    return {"clip_path": path, "meta": meta}
+
+
 @router.get("/{image_id}")
 async def get_image(
     image_id: int,
@@ -79,7 +169,46 @@ async def get_image(
         "url": image.url,
         "width": image.width,
         "height": image.height,
-        "project_id": image.project_id
+        "project_id": image.project_id,
+        "phash": phash.to_hex(image.phash) if image.phash is not None else None
+    }
+
+
+@router.get("/{image_id}/similar")
+async def similar_images(
+    image_id: int,
+    max_distance: int = Query(phash.NEAR_DUPLICATE_DISTANCE, ge=0, le=phash.MAX_SEARCH_DISTANCE, description="Hamming distance in bits"),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+) -> Dict[str, Any]:
+    image = db.query(Image.id, Image.phash, Image.content_hash).join(Project).filter(
+        Image.id == image_id,
+        Project.user_id == current_user.id
+    ).first()
+    
+    if not image:
+        raise HTTPException(status_code=404, detail="Image not found")
+    if image.phash is None:
+        raise HTTPException(status_code=409, detail="Image has no perceptual hash yet")
+    
+    similar = phash.find_similar(db, image.phash, current_user.id, max_distance, exclude_id=image.id, limit=limit)
+    return {
+        "image_id": image.id,
+        "phash": phash.to_hex(image.phash),
+        "truncated": similar.truncated,
+        "similar": [
+            {
+                "id": row.id,
+                "project_id": row.project_id,
+                "url": row.url,
+                "width": row.width,
+                "height": row.height,
+                "distance": distance,
+                "exact": bool(image.content_hash) and row.content_hash == image.content_hash
+            }
+            for row, distance in similar.matches
+        ]
     }
 
 
@@ -98,10 +227,8 @@ async def delete_image(
     if not image:
         raise HTTPException(status_code=404, detail="Image not found")
     
-    # Delete file from storage (optional - you might want to keep files)
-    # os.remove(image.url) if os.path.exists(image.url) else None
-    
-    # Delete from database
+    # Delete from database (masks and variants cascade). Files are reclaimed by the
+    # media GC once they are unreferenced and past the grace period.
     db.delete(image)
     db.commit()
     
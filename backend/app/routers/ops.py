@@ -1,15 +1,36 @@
-from typing import List, Tuple, Dict, Any
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import List, Tuple, Dict, Any, Optional, Literal
 from pydantic import BaseModel, Field
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
-from ..services.segment import grabcut_segment
-from ..services.recolor import recolor_hsv
-from ..services.overlay import overlay_wheel
-from ..services.storage import read_image_bgr_or_bgra, save_image_np, ensure_path_exists
+# Image ops run in the process pools of the executor layer, so the API process
+# never imports the segment/recolor/overlay services itself.
+from ..services import admission, executor, detection_cache, progress
+from ..services.auth import get_current_user, User
+from ..services.singleflight import ops_flight, op_key
+from ..services.storage import read_image_bgr_or_bgra, save_image_np, shard_dir, probe_clip
+from ..database import get_db, Image, Mask, Project
 
 
 router = APIRouter()
 
+# Longest clip /ops/clip accepts (about a minute at 30 fps)
+CLIP_MAX_FRAMES = int(os.getenv("OPS_CLIP_MAX_FRAMES", "1800"))
+# Full-resolution renders one palette call may ask for; each is a whole output frame
+PALETTE_MAX_FULL_RES = int(os.getenv("OPS_PALETTE_MAX_FULL_RES", "4"))
+# Comment lines keep idle progress streams open through proxies
+PROGRESS_KEEPALIVE_SECONDS = 15.0
+# A stream whose id no op in this process has claimed by then ends with an error:
+# the op most likely went to another API worker
+PROGRESS_CLAIM_SECONDS = float(os.getenv("OPS_PROGRESS_CLAIM_SECONDS", "30"))
+
 
 class Point(BaseModel):
 	x: float
@@ -18,53 +39,455 @@ class Point(BaseModel):
 
 class SegmentRequest(BaseModel):
 	image_path: str = Field(..., description="Path returned from upload endpoint")
+	rect: Optional[List[int]] = Field(None, min_items=4, max_items=4, description="x, y, w, h; detected when omitted")
+	image_id: Optional[int] = Field(None, description="Store the result as a Mask row of this image")
+	contours: bool = Field(False, description="Also return simplified mask polygons")
+
+
+class Stroke(BaseModel):
+	points: List[Point] = Field(..., min_items=1)
+	label: Literal["fg", "bg"]
+	radius: float = Field(8.0, gt=0, le=256)
+
+
+class RefineRequest(BaseModel):
+	mask_id: int
+	strokes: List[Stroke] = Field(..., min_items=1)
+	iterations: int = Field(1, ge=1, le=2)
+	contours: bool = False
+
+
+class DetectRequest(BaseModel):
+	image_path: str
+	mask_path: Optional[str] = Field(None, description="Body mask to tighten the vehicle rect")
 
 
 class RecolorRequest(BaseModel):
 	image_path: str
-	mask_path: str
+	mask_path: Optional[str] = None
+	mask_id: Optional[int] = Field(None, description="Use the stored compact mask instead of mask_path")
 	dh: int = 0
 	ds: float = 0.0
 	dv: float = 0.0
 
 
+class Swatch(BaseModel):
+	dh: int = 0
+	ds: float = 0.0
+	dv: float = 0.0
+	color: Optional[str] = Field(None, pattern=r"^#?[0-9a-fA-F]{6}$", description="Target body colour, overrides dh/ds/dv")
+
+
+class PaletteRequest(BaseModel):
+	image_path: str
+	mask_path: Optional[str] = None
+	mask_id: Optional[int] = None
+	swatches: List[Swatch] = Field(..., min_items=1, max_items=64)
+	preview_size: int = Field(256, ge=32, le=1024, description="Long side of each preview")
+	columns: int = Field(4, ge=1, le=16, description="Contact sheet columns")
+	full_res: List[int] = Field(default_factory=list, max_items=PALETTE_MAX_FULL_RES, description="Swatch indices to also render at full resolution")
+
+
 class OverlayWheelRequest(BaseModel):
 	base_image_path: str
 	wheel_image_path: str
-	dst_pts: List[Point] = Field(..., min_items=4, max_items=4)
+	dst_pts: Optional[List[Point]] = Field(None, min_items=4, max_items=4, description="Detected when omitted")
+	wheel_index: int = Field(0, ge=0, description="Which detected wheel to use when dst_pts is omitted")
 
 
-@router.post("/segment")
-def segment_body(req: SegmentRequest) -> Dict[str, Any]:
-	image = read_image_bgr_or_bgra(req.image_path)
+class ClipRequest(BaseModel):
+	clip_path: str = Field(..., description="Path returned from the clip upload endpoint")
+	recolor: Optional[Swatch] = None
+	wheel_image_path: Optional[str] = None
+	wheel_index: int = Field(0, ge=0)
+	rect: Optional[List[int]] = Field(None, min_items=4, max_items=4, description="Vehicle rect on the first frame; detected when omitted")
+	keyframe_interval: int = Field(12, ge=1, le=120, description="Frames between GrabCut keyframes; masks are tracked in between")
+
+
+async def admitted_user(current_user: User = Depends(get_current_user)) -> User:
+	# Rate limited on arrival, before any image is read
+	admission.rate_limiter.check(current_user.id)
+	return current_user
+
+
+async def op_progress(
+	progress_id: Optional[str] = Query(
+		None, min_length=8, max_length=64, pattern=r"^[A-Za-z0-9_-]+$",
+		description="Client-chosen id; progress is streamed on GET /ops/progress/{progress_id}",
+	),
+	user: User = Depends(admitted_user),
+) -> progress.Tracker:
+	if progress_id and not progress.hub.open(progress_id, user.id, claim=True):
+		raise HTTPException(status_code=409, detail="progress_id belongs to another user")
+	return progress.Tracker(progress_id)
+
+
+async def _run_op(
+	user_id: int,
+	op: str,
+	target: str,
+	arrays: Dict[str, Any],
+	priority: str,
+	megapixels: Optional[float] = None,
+	tracker: Optional[progress.Tracker] = None,
+	**params: Any,
+) -> Any:
+	"""``executor.run_op`` once the admission scheduler gives ``user_id`` a turn."""
+	tracker = tracker or progress.Tracker()
+	if megapixels is None:
+		megapixels = max((a.shape[0] * a.shape[1] for a in arrays.values()), default=0) / 1e6
+	tracker.stage("queued", op=op)
+	async with admission.scheduler.slot(user_id, admission.op_cost(op, megapixels)):
+		tracker.stage("running", op=op)
+		return await executor.run_op(target, arrays, priority=priority, progress_id=tracker.id, **params)
+
+
+async def _detect(user_id: int, image_path: str, image=None, mask_path: Optional[str] = None, tracker: Optional[progress.Tracker] = None) -> Optional[Dict[str, Any]]:
+	detection = await run_in_threadpool(detection_cache.get, image_path, mask_path)
+	if detection is not None:
+		return detection
 	if image is None:
+		image = await run_in_threadpool(read_image_bgr_or_bgra, image_path)
+		if image is None:
+			return None
+	arrays = {"image_bgr": image}
+	if mask_path:
+		mask = await run_in_threadpool(read_image_bgr_or_bgra, mask_path, prefer_gray=True)
+		if mask is not None:
+			arrays["body_mask"] = mask
+	detection = await _run_op(user_id, "detect", "detect:detect_vehicle", arrays, executor.INTERACTIVE, tracker=tracker)
+	await run_in_threadpool(detection_cache.put, image_path, detection, mask_path if "body_mask" in arrays else None)
+	return detection
+
+
+@router.post("/detect")
+async def detect(req: DetectRequest, user: User = Depends(admitted_user)) -> Dict[str, Any]:
+	detection = await _detect(user.id, req.image_path, mask_path=req.mask_path)
+	if detection is None:
 		raise HTTPException(status_code=400, detail="image_path not found or unreadable")
-	mask = grabcut_segment(image)
-	out_path = save_image_np(mask, subdir="masks", force_gray=True)
-	return {"mask_path": out_path}
+	return detection
 
 
-@router.post("/recolor")
-def recolor(req: RecolorRequest) -> Dict[str, Any]:
-	image = read_image_bgr_or_bgra(req.image_path)
-	mask = read_image_bgr_or_bgra(req.mask_path, prefer_gray=True)
+async def _segment(req: SegmentRequest, db: Session, user_id: int, tracker: progress.Tracker) -> Dict[str, Any]:
+	from ..services.maskcodec import encode_mask, encode_grabcut_state
+
+	tracker.stage("decode")
+	image = await run_in_threadpool(read_image_bgr_or_bgra, req.image_path)
+	if image is None:
+		raise HTTPException(status_code=400, detail="image_path not found or unreadable")
+	rect = tuple(req.rect) if req.rect else tuple((await _detect(user_id, req.image_path, image, tracker=tracker))["rect"])
+	mask, state, bgd, fgd = await _run_op(
+		user_id, "segment", "segment:grabcut_segment_with_state", {"image_bgr": image}, executor.HEAVY,
+		tracker=tracker, rect=rect,
+	)
+	tracker.stage("encode")
+	out_path = await run_in_threadpool(save_image_np, mask, subdir="masks", force_gray=True)
+	response: Dict[str, Any] = {"mask_path": out_path}
+	if req.image_id is not None:
+		# Keep the GrabCut labels and models so /segment/refine can resume from them
+		gc_state, gc_models = await run_in_threadpool(encode_grabcut_state, state, bgd, fgd)
+		db_mask = Mask(
+			image_id=req.image_id, kind="body", url=out_path,
+			data=await run_in_threadpool(encode_mask, mask), gc_state=gc_state, gc_models=gc_models,
+		)
+		db.add(db_mask)
+		db.commit()
+		db.refresh(db_mask)
+		response["mask_id"] = db_mask.id
+	if req.contours:
+		response["contours"] = await _run_op(user_id, "contours", "maskcodec:mask_contours", {"mask": mask}, executor.INTERACTIVE)
+	return response
+
+
+@router.post("/segment")
+async def segment_body(
+	req: SegmentRequest,
+	db: Session = Depends(get_db),
+	user: User = Depends(admitted_user),
+	tracker: progress.Tracker = Depends(op_progress),
+) -> Dict[str, Any]:
+	async def owned_segment() -> Dict[str, Any]:
+		# Checked before joining a flight, so nobody shares a run that stores into another user's image
+		if req.image_id is not None and not db.query(Image.id).join(Project).filter(
+			Image.id == req.image_id, Project.user_id == user.id,
+		).first():
+			raise HTTPException(status_code=404, detail="Image not found")
+		# Double clicks and retries share one GrabCut run and one output file
+		key = op_key("segment", [req.image_path], req.model_dump(mode="json"))
+		return await ops_flight.do(key, lambda: _segment(req, db, user.id, tracker))
+
+	return await tracker.run(owned_segment())
+
+
+@router.post("/segment/refine")
+async def refine_segment(req: RefineRequest, db: Session = Depends(get_db), user: User = Depends(admitted_user)) -> Dict[str, Any]:
+	import numpy as np
+	from ..services.maskcodec import encode_mask, encode_grabcut_state, decode_grabcut_state
+
+	db_mask = db.query(Mask).join(Image).join(Project).filter(
+		Mask.id == req.mask_id, Project.user_id == user.id,
+	).first()
+	if not db_mask:
+		raise HTTPException(status_code=404, detail="Mask not found")
+	image_row = db.query(Image.url).filter(Image.id == db_mask.image_id).first()
+	image = await run_in_threadpool(read_image_bgr_or_bgra, image_row.url) if image_row else None
+	if image is None:
+		raise HTTPException(status_code=400, detail="Image of this mask is unreadable")
+
+	state = None
+	if db_mask.gc_state:
+		try:
+			state, bgd, fgd = await run_in_threadpool(decode_grabcut_state, db_mask.gc_state, db_mask.gc_models)
+		except ValueError:
+			# Unusable saved state: start over from the binary mask
+			pass
+	if state is None:
+		# Masks without saved GrabCut state: start from probable fg/bg labels
+		binary = await _load_mask(db, user.id, db_mask.id, None)
+		state = np.where(binary > 0, 3, 2).astype(np.uint8)
+		bgd = fgd = np.zeros((1, 65), np.float64)
+	if state.shape != image.shape[:2]:
+		raise HTTPException(status_code=409, detail="Mask and image sizes differ")
+
+	strokes = [
+		{"points": [(p.x, p.y) for p in s.points], "label": s.label, "radius": s.radius}
+		for s in req.strokes
+	]
+	mask, state = await _run_op(
+		user.id, "refine", "segment:grabcut_refine", {"image_bgr": image, "state": state, "bgd": bgd, "fgd": fgd},
+		executor.INTERACTIVE, strokes=strokes, iterations=req.iterations,
+	)
+	out_path = await run_in_threadpool(save_image_np, mask, subdir="masks", force_gray=True)
+	db_mask.url = out_path
+	db_mask.data = await run_in_threadpool(encode_mask, mask)
+	db_mask.gc_state, _ = await run_in_threadpool(encode_grabcut_state, state, bgd, fgd)
+	db.commit()
+
+	response: Dict[str, Any] = {"mask_id": db_mask.id, "mask_path": out_path}
+	if req.contours:
+		response["contours"] = await _run_op(user.id, "contours", "maskcodec:mask_contours", {"mask": mask}, executor.INTERACTIVE)
+	return response
+
+
+def _stored_mask_path(db: Session, user_id: int, mask_id: Optional[int]) -> Optional[str]:
+	"""Current file of a stored mask, for op keys: refine writes a new file, so a refined mask gets a new key."""
+	if mask_id is None:
+		return None
+	row = db.query(Mask.url).join(Image).join(Project).filter(Mask.id == mask_id, Project.user_id == user_id).first()
+	if not row:
+		raise HTTPException(status_code=404, detail="Mask not found")
+	return row.url
+
+
+async def _load_mask(db: Session, user_id: int, mask_id: Optional[int], mask_path: Optional[str]):
+	from ..services.maskcodec import decode_mask
+
+	if mask_id is not None:
+		row = db.query(Mask.data, Mask.url).join(Image).join(Project).filter(
+			Mask.id == mask_id, Project.user_id == user_id,
+		).first()
+		if not row:
+			raise HTTPException(status_code=404, detail="Mask not found")
+		if row.data:
+			# Compact masks decode straight to booleans, no PNG round trip
+			try:
+				return await run_in_threadpool(decode_mask, row.data)
+			except ValueError:
+				pass
+		mask_path = row.url
+	if not mask_path:
+		raise HTTPException(status_code=422, detail="mask_path or mask_id is required")
+	return await run_in_threadpool(read_image_bgr_or_bgra, mask_path, prefer_gray=True)
+
+
+async def _recolor(req: RecolorRequest, db: Session, user_id: int, tracker: progress.Tracker) -> Dict[str, Any]:
+	tracker.stage("decode")
+	image = await run_in_threadpool(read_image_bgr_or_bgra, req.image_path)
+	mask = await _load_mask(db, user_id, req.mask_id, req.mask_path)
 	if image is None or mask is None:
 		raise HTTPException(status_code=400, detail="image_path or mask_path unreadable")
-	result = recolor_hsv(image, mask, dh=req.dh, ds=req.ds, dv=req.dv)
-	out_path = save_image_np(result, subdir="variants")
+	result = await _run_op(
+		user_id, "recolor", "recolor:recolor_hsv", {"image_bgr": image, "mask": mask}, executor.INTERACTIVE,
+		tracker=tracker, dh=req.dh, ds=req.ds, dv=req.dv,
+	)
+	tracker.stage("encode")
+	out_path = await run_in_threadpool(save_image_np, result, subdir="variants")
 	return {"image_path": out_path}
 
 
-@router.post("/overlay/wheel")
-def overlay_wheel_api(req: OverlayWheelRequest) -> Dict[str, Any]:
-	base = read_image_bgr_or_bgra(req.base_image_path)
-	wheel = read_image_bgr_or_bgra(req.wheel_image_path, keep_alpha=True)
+@router.post("/recolor")
+async def recolor(
+	req: RecolorRequest,
+	db: Session = Depends(get_db),
+	user: User = Depends(admitted_user),
+	tracker: progress.Tracker = Depends(op_progress),
+) -> Dict[str, Any]:
+	async def keyed_recolor() -> Dict[str, Any]:
+		key = op_key("recolor", [req.image_path, req.mask_path, _stored_mask_path(db, user.id, req.mask_id)], req.model_dump(mode="json"))
+		return await ops_flight.do(key, lambda: _recolor(req, db, user.id, tracker))
+
+	return await tracker.run(keyed_recolor())
+
+
+async def _recolor_palette(req: PaletteRequest, db: Session, user_id: int, tracker: progress.Tracker) -> Dict[str, Any]:
+	if any(i < 0 or i >= len(req.swatches) for i in req.full_res):
+		raise HTTPException(status_code=422, detail="full_res index out of range")
+	tracker.stage("decode")
+	image = await run_in_threadpool(read_image_bgr_or_bgra, req.image_path)
+	mask = await _load_mask(db, user_id, req.mask_id, req.mask_path)
+	if image is None or mask is None:
+		raise HTTPException(status_code=400, detail="image_path or mask_path unreadable")
+	sheet, previews, renders, resolved = await _run_op(
+		user_id, "palette", "recolor:recolor_palette", {"image_bgr": image, "mask": mask}, executor.INTERACTIVE,
+		tracker=tracker,
+		swatches=[sw.model_dump() for sw in req.swatches], preview_max_side=req.preview_size,
+		full_res=sorted(set(req.full_res)), columns=req.columns,
+	)
+
+	def _save_all() -> Dict[str, Any]:
+		preview_items = [
+			{"index": i, "image_path": save_image_np(preview, subdir="variants", ext=".jpg"), **resolved[i]}
+			for i, preview in enumerate(previews)
+		]
+		render_paths = {
+			str(i): save_image_np(render, subdir="variants")
+			for i, render in zip(sorted(set(req.full_res)), renders)
+		}
+		return {
+			"contact_sheet_path": save_image_np(sheet, subdir="variants", ext=".jpg"),
+			"previews": preview_items,
+			"renders": render_paths,
+		}
+
+	tracker.stage("encode")
+	return await run_in_threadpool(_save_all)
+
+
+@router.post("/recolor/palette")
+async def recolor_palette(
+	req: PaletteRequest,
+	db: Session = Depends(get_db),
+	user: User = Depends(admitted_user),
+	tracker: progress.Tracker = Depends(op_progress),
+) -> Dict[str, Any]:
+	async def keyed_palette() -> Dict[str, Any]:
+		key = op_key("recolor_palette", [req.image_path, req.mask_path, _stored_mask_path(db, user.id, req.mask_id)], req.model_dump(mode="json"))
+		return await ops_flight.do(key, lambda: _recolor_palette(req, db, user.id, tracker))
+
+	return await tracker.run(keyed_palette())
+
+
+async def _overlay_wheel(req: OverlayWheelRequest, user_id: int, tracker: progress.Tracker) -> Dict[str, Any]:
+	tracker.stage("decode")
+	base = await run_in_threadpool(read_image_bgr_or_bgra, req.base_image_path)
+	wheel = await run_in_threadpool(read_image_bgr_or_bgra, req.wheel_image_path, keep_alpha=True)
 	if base is None or wheel is None:
 		raise HTTPException(status_code=400, detail="base_image_path or wheel_image_path unreadable")
 	h, w = wheel.shape[:2]
 	src_pts = [(0, 0), (w - 1, 0), (w - 1, h - 1), (0, h - 1)]
-	dst_pts = [(p.x, p.y) for p in req.dst_pts]
-	result = overlay_wheel(base, wheel, src_pts, dst_pts)
-	out_path = save_image_np(result, subdir="variants")
+	if req.dst_pts:
+		dst_pts = [(p.x, p.y) for p in req.dst_pts]
+	else:
+		wheels = (await _detect(user_id, req.base_image_path, base, tracker=tracker))["wheels"]
+		if req.wheel_index >= len(wheels):
+			raise HTTPException(status_code=422, detail=f"dst_pts omitted and only {len(wheels)} wheel(s) detected")
+		dst_pts = [tuple(p) for p in wheels[req.wheel_index]["quad"]]
+	result = await _run_op(
+		user_id, "overlay", "overlay:overlay_wheel", {"base_bgr": base, "wheel_bgra": wheel}, executor.INTERACTIVE,
+		tracker=tracker, src_pts=src_pts, dst_pts=dst_pts,
+	)
+	tracker.stage("encode")
+	out_path = await run_in_threadpool(save_image_np, result, subdir="variants")
 	return {"image_path": out_path}
 
+
+@router.post("/overlay/wheel")
+async def overlay_wheel_api(
+	req: OverlayWheelRequest,
+	user: User = Depends(admitted_user),
+	tracker: progress.Tracker = Depends(op_progress),
+) -> Dict[str, Any]:
+	key = op_key("overlay_wheel", [req.base_image_path, req.wheel_image_path], req.model_dump(mode="json"))
+	return await tracker.run(ops_flight.do(key, lambda: _overlay_wheel(req, user.id, tracker)))
+
+
+async def _process_clip(req: ClipRequest, user_id: int, tracker: progress.Tracker) -> Dict[str, Any]:
+	if req.recolor is None and req.wheel_image_path is None:
+		raise HTTPException(status_code=422, detail="recolor or wheel_image_path is required")
+	meta = await run_in_threadpool(probe_clip, req.clip_path)
+	if meta is None:
+		raise HTTPException(status_code=400, detail="clip_path not found or unreadable")
+	if meta["frames"] > CLIP_MAX_FRAMES:
+		raise HTTPException(status_code=413, detail=f"Clip has {meta['frames']} frames, limit is {CLIP_MAX_FRAMES}")
+	arrays = {}
+	if req.wheel_image_path:
+		wheel = await run_in_threadpool(read_image_bgr_or_bgra, req.wheel_image_path, keep_alpha=True)
+		if wheel is None:
+			raise HTTPException(status_code=400, detail="wheel_image_path unreadable")
+		arrays["wheel_bgra"] = wheel
+
+	uid = str(uuid.uuid4())
+	out_dir = shard_dir("variants", uid)
+	await run_in_threadpool(os.makedirs, out_dir, exist_ok=True)
+	out_path = os.path.join(out_dir, f"{uid}.mp4").replace("\\", "/")
+	# Decoding and tracking are sequential per clip, so the whole clip is one heavy op,
+	# costed by its frame size: that is the load it puts on the machine at any moment
+	stats = await _run_op(
+		user_id, "clip", "clip:process_clip", arrays, executor.HEAVY, megapixels=meta["width"] * meta["height"] / 1e6, tracker=tracker,
+		src_path=req.clip_path, out_path=out_path,
+		recolor=req.recolor.model_dump() if req.recolor else None, wheel_index=req.wheel_index,
+		rect=tuple(req.rect) if req.rect else None, keyframe_interval=req.keyframe_interval,
+		max_frames=CLIP_MAX_FRAMES,
+	)
+	return {"clip_path": out_path, **stats}
+
+
+@router.post("/clip")
+async def process_clip(
+	req: ClipRequest,
+	user: User = Depends(admitted_user),
+	tracker: progress.Tracker = Depends(op_progress),
+) -> Dict[str, Any]:
+	key = op_key("clip", [req.clip_path, req.wheel_image_path], req.model_dump(mode="json"))
+	return await tracker.run(ops_flight.do(key, lambda: _process_clip(req, user.id, tracker)))
+
+
+@router.get("/progress/{progress_id}")
+async def stream_progress(progress_id: str, user: User = Depends(get_current_user)) -> StreamingResponse:
+	"""Server-Sent Events for one ``progress_id``: stages, previews, then ``result`` or ``error``.
+
+	May be opened before the op is submitted; earlier events are replayed.
+	Progress is tracked per API process: if no op here claims the id within
+	``PROGRESS_CLAIM_SECONDS``, the stream ends with a 404 ``error`` event.
+	"""
+	queue = progress.hub.subscribe(progress_id, user.id)
+	if queue is None:
+		raise HTTPException(status_code=404, detail="Progress channel not found")
+
+	async def events():
+		claim_deadline = time.monotonic() + PROGRESS_CLAIM_SECONDS
+		try:
+			while True:
+				wait = PROGRESS_KEEPALIVE_SECONDS
+				if not progress.hub.claimed(progress_id):
+					left = claim_deadline - time.monotonic()
+					if left <= 0:
+						event = {"stage": "error", "status": 404, "detail": "No operation claimed this progress_id on this server", "final": True}
+						yield f"event: error\ndata: {json.dumps(event)}\n\n"
+						return
+					wait = min(wait, left)
+				try:
+					event = await asyncio.wait_for(queue.get(), wait)
+				except asyncio.TimeoutError:
+					yield ": keep-alive\n\n"
+					continue
+				yield f"event: {event['stage']}\ndata: {json.dumps(event)}\n\n"
+				if event.get("final"):
+					return
+		finally:
+			progress.hub.unsubscribe(progress_id, queue)
+
+	return StreamingResponse(
+		events(), media_type="text/event-stream",
+		headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+	)
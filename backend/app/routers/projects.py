@@ -1,11 +1,16 @@
 from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from datetime import datetime
 
-from ..database import get_db, Project, User, Image
+from ..database import get_db, Project, ProjectShare, User, Image
 from ..services.auth import get_current_user
+from ..services.media_gc import project_storage, user_storage
+from ..services.archive import ArchiveError, import_project, iter_export
+from .share import discard_share
 
 router = APIRouter()
 
@@ -28,6 +33,20 @@ class ProjectResponse(BaseModel):
         from_attributes = True
 
 
+class ProjectStorageResponse(BaseModel):
+    project_id: int
+    images_bytes: int
+    masks_bytes: int
+    variants_bytes: int
+    cache_bytes: int
+    total_bytes: int
+
+
+class UserStorageResponse(BaseModel):
+    total_bytes: int
+    projects: List[ProjectStorageResponse]
+
+
 class ProjectDetailResponse(BaseModel):
     id: int
     title: str
@@ -80,6 +99,78 @@ async def get_projects(
     return result
 
 
+@router.get("/storage", response_model=UserStorageResponse)
+async def get_storage_usage(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    return await run_in_threadpool(user_storage, db, current_user.id)
+
+
+@router.post("/import")
+async def import_project_archive(
+    file: UploadFile = File(...),
+    title: Optional[str] = Form(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    # The upload is already spooled to a temp file; entries are copied out one chunk at a time
+    try:
+        return await run_in_threadpool(import_project, db, current_user.id, file.file, title)
+    except ArchiveError as exc:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(exc)
+        )
+
+
+@router.get("/{project_id}/export")
+async def export_project(
+    project_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    project = db.query(Project).filter(
+        Project.id == project_id,
+        Project.user_id == current_user.id
+    ).first()
+    
+    if not project:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Project not found"
+        )
+    
+    # Streamed as it is built: no Content-Length, nothing staged in memory or on disk
+    return StreamingResponse(
+        iter_export(project.id),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="project-{project.id}.zip"'}
+    )
+
+
+@router.get("/{project_id}/storage", response_model=ProjectStorageResponse)
+async def get_project_storage_usage(
+    project_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    project = db.query(Project).filter(
+        Project.id == project_id,
+        Project.user_id == current_user.id
+    ).first()
+    
+    if not project:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Project not found"
+        )
+    
+    usage = await run_in_threadpool(project_storage, db, project.id)
+    return ProjectStorageResponse(project_id=project.id, **usage)
+
+
 @router.get("/{project_id}", response_model=ProjectDetailResponse)
 async def get_project(
     project_id: int,
@@ -166,7 +257,12 @@ async def delete_project(
             detail="Project not found"
         )
     
+    share = db.query(ProjectShare.slug).filter(ProjectShare.project_id == project.id).first()
+    # Images, masks, variants and the share record cascade; files go to the media GC
     db.delete(project)
     db.commit()
+    if share:
+        # The public page must go now, not when the GC gets to it
+        await discard_share(share.slug)
     
     return {"message": "Project deleted successfully"}
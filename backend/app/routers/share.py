@@ -1,14 +1,31 @@
+import os
+import hashlib
 import secrets
-from typing import Optional
-from fastapi import APIRouter, HTTPException, Depends
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 
-from ..database import get_db, Project, Image, Variant
+from ..database import get_db, Project, Image, Variant, ProjectShare
 from ..services.auth import get_current_user, User
+from ..services.snapshot import new_version, prune_versions, render_display_webp, remove_snapshot
 
 router = APIRouter()
 
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "http://localhost:3000")
+SHARE_CACHE_CONTROL = os.getenv("SHARE_CACHE_CONTROL", "public, max-age=3600, stale-while-revalidate=86400")
+# Other workers drop a manifest that was unshared elsewhere after this long
+SHARE_MANIFEST_TTL_SECONDS = float(os.getenv("SHARE_MANIFEST_TTL_SECONDS", "30"))
+_MANIFEST_CACHE_SIZE = 1024
+
+# slug -> (expires_at, etag, manifest bytes)
+_manifest_cache: "OrderedDict[str, Tuple[float, str, bytes]]" = OrderedDict()
+_manifest_lock = threading.Lock()
+
 
 class ShareProjectRequest(BaseModel):
     project_id: int
@@ -26,6 +43,57 @@ class SharedProjectResponse(BaseModel):
     variants: list
 
 
+def _cache_get(slug: str) -> Optional[Tuple[str, bytes]]:
+    with _manifest_lock:
+        entry = _manifest_cache.get(slug)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del _manifest_cache[slug]
+            return None
+        _manifest_cache.move_to_end(slug)
+        return entry[1], entry[2]
+
+
+def _cache_put(slug: str, etag: str, body: bytes) -> None:
+    with _manifest_lock:
+        _manifest_cache[slug] = (time.monotonic() + SHARE_MANIFEST_TTL_SECONDS, etag, body)
+        _manifest_cache.move_to_end(slug)
+        while len(_manifest_cache) > _MANIFEST_CACHE_SIZE:
+            _manifest_cache.popitem(last=False)
+
+
+def _cache_invalidate(slug: str) -> None:
+    with _manifest_lock:
+        _manifest_cache.pop(slug, None)
+
+
+async def discard_share(slug: str) -> None:
+    """Take a deleted share offline right away: cached manifest and snapshot files."""
+    _cache_invalidate(slug)
+    await run_in_threadpool(remove_snapshot, slug)
+
+
+def _build_snapshot(slug: str, version: str, project: Project, images: list, variants: list) -> str:
+    # Runs in the thread pool: renders display derivatives into a fresh version directory
+    # and freezes the manifest. The live version is untouched until the commit switches to it.
+    try:
+        image_data = []
+        for img in images:
+            item = {"id": img.id, "url": img.url, "width": img.width, "height": img.height}
+            item.update(render_display_webp(img.url, slug, f"image-{img.id}", version) or {})
+            image_data.append(item)
+        variant_data = []
+        for variant in variants:
+            item = {"id": variant.id, "image_id": variant.image_id, "description": variant.description, "url": variant.url}
+            item.update(render_display_webp(variant.url, slug, f"variant-{variant.id}", version) or {})
+            variant_data.append(item)
+    except BaseException:
+        remove_snapshot(slug, version)
+        raise
+    return SharedProjectResponse(title=project.title, images=image_data, variants=variant_data).model_dump_json()
+
+
 @router.post("/projects", response_model=ShareResponse)
 async def share_project(
     share_data: ShareProjectRequest,
@@ -41,46 +109,52 @@ async def share_project(
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
-    # Generate unique slug
-    slug = secrets.token_urlsafe(16)
+    # Re-publishing refreshes the snapshot but keeps the link stable
+    share = db.query(ProjectShare).filter(ProjectShare.project_id == project.id).first()
+    slug = share.slug if share else secrets.token_urlsafe(16)
+    
+    images = db.query(Image).filter(Image.project_id == project.id).all()
+    variants = db.query(Variant).join(Image).filter(Image.project_id == project.id).all()
+    version = new_version()
+    manifest_json = await run_in_threadpool(_build_snapshot, slug, version, project, images, variants)
+    etag = '"' + hashlib.sha256(manifest_json.encode("utf-8")).hexdigest()[:32] + '"'
     
-    # In a real implementation, you'd store this in a separate table
-    # For now, we'll just return the slug
-    # You could also store it in the project table or create a separate sharing table
+    try:
+        if share:
+            share.manifest_json = manifest_json
+            share.etag = etag
+            share.snapshot_version = version
+        else:
+            db.add(ProjectShare(project_id=project.id, slug=slug, manifest_json=manifest_json, etag=etag, snapshot_version=version))
+        db.commit()
+    except Exception:
+        db.rollback()
+        await run_in_threadpool(remove_snapshot, slug, version)
+        raise
+    _cache_invalidate(slug)
+    # Earlier versions go once cached manifests pointing at them have expired
+    await run_in_threadpool(prune_versions, slug, version)
     
-    base_url = "http://localhost:3000"  # This should come from environment
-    public_url = f"{base_url}/share/{slug}"
+    public_url = f"{PUBLIC_BASE_URL}/share/{slug}"
     
     return ShareResponse(slug=slug, public_url=public_url)
 
 
 @router.get("/{slug}", response_model=SharedProjectResponse)
-async def get_shared_project(slug: str, db: Session = Depends(get_db)):
-    # In a real implementation, you'd look up the slug in a sharing table
-    # For now, we'll return a mock response
-    # This is where you'd implement the actual sharing logic
-    
-    # Mock data for demonstration
-    # In reality, you'd query the database based on the slug
+def get_shared_project(slug: str, request: Request, db: Session = Depends(get_db)):
+    cached = _cache_get(slug)
+    if cached is None:
+        share = db.query(ProjectShare.etag, ProjectShare.manifest_json).filter(ProjectShare.slug == slug).first()
+        if not share:
+            raise HTTPException(status_code=404, detail="Shared project not found")
+        cached = (share.etag, share.manifest_json.encode("utf-8"))
+        _cache_put(slug, *cached)
     
-    return SharedProjectResponse(
-        title="Shared Project",
-        images=[
-            {
-                "id": 1,
-                "url": "/media/images/sample.jpg",
-                "width": 800,
-                "height": 600
-            }
-        ],
-        variants=[
-            {
-                "id": 1,
-                "description": "Modified version",
-                "url": "/media/variants/sample_modified.jpg"
-            }
-        ]
-    )
+    etag, body = cached
+    headers = {"Cache-Control": SHARE_CACHE_CONTROL, "ETag": etag}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 @router.delete("/projects/{project_id}")
@@ -98,7 +172,11 @@ async def unshare_project(
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
-    # In a real implementation, you'd remove the sharing record
-    # For now, just return success
+    share = db.query(ProjectShare).filter(ProjectShare.project_id == project.id).first()
+    if share:
+        slug = share.slug
+        db.delete(share)
+        db.commit()
+        await discard_share(slug)
     
     return {"message": "Project unshared successfully"}
@@ -0,0 +1,234 @@
+"""Admission control and per-user fair scheduling for image ops.
+
+Every op request passes two gates:
+
+* a per-user token bucket, checked on arrival; an empty bucket is rejected
+  right away with 429 and the time until the next token;
+* the scheduler, which starts work while the user is under their concurrency
+  limit and the global cost budget (image megapixels x op weight) has room.
+  Work that does not fit waits in a per-user FIFO and freed capacity is
+  handed out round-robin across users, so one client's batch cannot push
+  everyone else to the back of the line.
+
+Over-full queues are refused immediately instead of piling up: 429 when the
+user's own queue is full, 503 when the global queue is full or a request has
+waited longer than the queue timeout, both with ``Retry-After``.
+
+State is per API process, like the single-flight memo.
+"""
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict
+
+from fastapi import HTTPException
+
+
+USER_RATE_PER_SECOND = float(os.getenv("OPS_USER_RATE_PER_SECOND", "2"))
+USER_BURST = float(os.getenv("OPS_USER_BURST", "10"))
+USER_MAX_CONCURRENT = int(os.getenv("OPS_USER_MAX_CONCURRENT", "2"))
+USER_MAX_QUEUED = int(os.getenv("OPS_USER_MAX_QUEUED", "8"))
+COST_BUDGET = float(os.getenv("OPS_COST_BUDGET_MP", "200"))
+MAX_QUEUED = int(os.getenv("OPS_MAX_QUEUED", "64"))
+QUEUE_TIMEOUT_SECONDS = float(os.getenv("OPS_QUEUE_TIMEOUT_SECONDS", "30"))
+
+# Relative cost per megapixel; GrabCut dominates everything else
+OP_WEIGHTS: Dict[str, float] = {
+	"segment": 4.0,
+	"refine": 1.0,
+	"recolor": 1.0,
+	"palette": 1.0,
+	"overlay": 1.0,
+	"detect": 0.25,
+	"contours": 0.1,
+	"clip": 8.0,
+}
+_MAX_BUCKETS = 10000
+
+
+def op_cost(op: str, megapixels: float) -> float:
+	return OP_WEIGHTS.get(op, 1.0) * max(megapixels, 0.01)
+
+
+def _retry_after(seconds: float) -> Dict[str, str]:
+	return {"Retry-After": str(max(1, int(math.ceil(seconds))))}
+
+
+class TokenBucket:
+	def __init__(self, rate: float, burst: float):
+		self.rate = rate
+		self.burst = burst
+		self.tokens = burst
+		self.updated = time.monotonic()
+
+	def take(self) -> float:
+		"""Take one token; returns 0 on success, otherwise seconds until one is available."""
+		now = time.monotonic()
+		self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+		if self.tokens >= 1.0:
+			self.tokens -= 1.0
+			return 0.0
+		return (1.0 - self.tokens) / self.rate
+
+
+class RateLimiter:
+	def __init__(self, rate: float = USER_RATE_PER_SECOND, burst: float = USER_BURST):
+		self.rate = rate
+		self.burst = burst
+		# A bucket idle long enough to refill is the same as a new one, so LRU eviction is safe
+		self._buckets: "OrderedDict[int, TokenBucket]" = OrderedDict()
+
+	def check(self, user_id: int) -> None:
+		if self.rate <= 0:
+			return
+		bucket = self._buckets.get(user_id)
+		if bucket is None:
+			bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+			while len(self._buckets) > _MAX_BUCKETS:
+				self._buckets.popitem(last=False)
+		self._buckets.move_to_end(user_id)
+		wait = bucket.take()
+		if wait > 0:
+			raise HTTPException(status_code=429, detail="Too many requests", headers=_retry_after(wait))
+
+
+class _Waiter:
+	__slots__ = ("user_id", "cost", "future")
+
+	def __init__(self, user_id: int, cost: float, future: "asyncio.Future[None]"):
+		self.user_id = user_id
+		self.cost = cost
+		self.future = future
+
+
+class Scheduler:
+	def __init__(
+		self,
+		budget: float = COST_BUDGET,
+		user_concurrency: int = USER_MAX_CONCURRENT,
+		user_queue: int = USER_MAX_QUEUED,
+		max_queued: int = MAX_QUEUED,
+		timeout: float = QUEUE_TIMEOUT_SECONDS,
+	):
+		self.budget = budget
+		self.user_concurrency = user_concurrency
+		self.user_queue = user_queue
+		self.max_queued = max_queued
+		self.timeout = timeout
+		self._running_cost = 0.0
+		self._running: Dict[int, int] = {}
+		# Users with waiting work, in round-robin order
+		self._queues: "OrderedDict[int, Deque[_Waiter]]" = OrderedDict()
+		self._queued = 0
+		self._avg_seconds = 1.0
+
+	def _estimate_wait(self, ahead: int) -> float:
+		slots = max(1, sum(self._running.values()))
+		return self._avg_seconds * (ahead + 1) / slots
+
+	def _dispatch(self) -> None:
+		# One pass starts at most one op per user; repeat until capacity or work runs out
+		while self._dispatch_pass():
+			pass
+
+	def _dispatch_pass(self) -> bool:
+		"""One round-robin pass over the waiting users; returns whether anything started."""
+		started = False
+		budget_reserved = False
+		for user_id in list(self._queues):
+			queue = self._queues[user_id]
+			while queue and queue[0].future.done():
+				queue.popleft()
+				self._queued -= 1
+			if not queue:
+				del self._queues[user_id]
+				continue
+			if self._running.get(user_id, 0) >= self.user_concurrency:
+				continue
+			head = queue[0]
+			# An op bigger than the whole budget runs alone rather than never
+			fits = self._running_cost + head.cost <= self.budget or self._running_cost == 0
+			if budget_reserved or not fits:
+				# Later users may not jump ahead of a head that is only waiting for budget
+				budget_reserved = True
+				continue
+			queue.popleft()
+			self._queued -= 1
+			# Served users go to the back of the rotation
+			del self._queues[user_id]
+			if queue:
+				self._queues[user_id] = queue
+			self._running[user_id] = self._running.get(user_id, 0) + 1
+			self._running_cost += head.cost
+			head.future.set_result(None)
+			started = True
+		return started
+
+	def _remove(self, waiter: _Waiter) -> None:
+		queue = self._queues.get(waiter.user_id)
+		if queue is not None and waiter in queue:
+			queue.remove(waiter)
+			self._queued -= 1
+			if not queue:
+				del self._queues[waiter.user_id]
+
+	def _release(self, waiter: _Waiter) -> None:
+		running = self._running.get(waiter.user_id, 0) - 1
+		if running > 0:
+			self._running[waiter.user_id] = running
+		else:
+			self._running.pop(waiter.user_id, None)
+		self._running_cost = max(0.0, self._running_cost - waiter.cost)
+		self._dispatch()
+
+	@asynccontextmanager
+	async def slot(self, user_id: int, cost: float) -> AsyncIterator[None]:
+		"""Wait for a fair turn to run an op of ``cost``; rejects with 429/503 when saturated."""
+		queue = self._queues.get(user_id)
+		if queue is not None and len(queue) >= self.user_queue:
+			raise HTTPException(status_code=429, detail="Too many queued operations", headers=_retry_after(self._estimate_wait(len(queue))))
+		if self._queued >= self.max_queued:
+			raise HTTPException(status_code=503, detail="Server busy", headers=_retry_after(self._estimate_wait(self._queued)))
+
+		waiter = _Waiter(user_id, cost, asyncio.get_running_loop().create_future())
+		if queue is None:
+			queue = self._queues[user_id] = deque()
+		queue.append(waiter)
+		self._queued += 1
+		self._dispatch()
+		try:
+			await asyncio.wait_for(waiter.future, self.timeout)
+		except BaseException as exc:
+			if waiter.future.done() and not waiter.future.cancelled():
+				# Granted just as the wait was given up
+				self._release(waiter)
+			else:
+				self._remove(waiter)
+				self._dispatch()
+			if isinstance(exc, asyncio.TimeoutError):
+				raise HTTPException(status_code=503, detail="Server busy", headers=_retry_after(self._estimate_wait(self._queued))) from None
+			raise
+
+		started = time.monotonic()
+		try:
+			yield
+		finally:
+			self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * (time.monotonic() - started)
+			self._release(waiter)
+
+	def status(self) -> Dict[str, float]:
+		return {
+			"running": sum(self._running.values()),
+			"running_cost": round(self._running_cost, 2),
+			"budget": self.budget,
+			"queued": self._queued,
+			"queued_users": len(self._queues),
+		}
+
+
+rate_limiter = RateLimiter()
+scheduler = Scheduler()
@@ -0,0 +1,356 @@
+"""Streaming project export / import archives.
+
+Export writes a ZIP straight to the response: ``manifest.json`` first, then
+every original, mask and variant file, copied in chunks. ``zipfile`` is
+given an unseekable sink, so entries use data descriptors and nothing is
+staged in memory or on disk; the only per-project state is the row metadata
+in the manifest.
+
+Import reads the uploaded archive entry by entry, hashing while it copies.
+Originals whose content hash matches an image of the importing user reuse
+that file; everything else lands at a path addressed by the user and the
+content, so re-importing the same archive writes nothing new. Image size and
+perceptual hash are computed from the imported bytes, never taken from the
+manifest. Rows are inserted in batches with one commit.
+"""
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+import zipfile
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from ..database import SessionLocal, Project, Image, Mask, Variant
+from . import maskcodec, phash
+from .storage import BASE_MEDIA_DIR, shard_dir
+
+
+ARCHIVE_FORMAT = "arabamodifiye-project"
+ARCHIVE_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+CHUNK_BYTES = 1 << 20
+IMPORT_MAX_BYTES = int(os.getenv("PROJECT_IMPORT_MAX_UNCOMPRESSED_MB", "4096")) * 1024 * 1024
+IMPORT_MAX_ENTRIES = int(os.getenv("PROJECT_IMPORT_MAX_ENTRIES", "100000"))
+_BLOB_MAX_BYTES = 64 * 1024 * 1024
+_INSERT_BATCH = 200
+
+# Mask columns exported as their own entries: (column, archive suffix)
+_MASK_BLOBS = (("data", ".amk"), ("gc_state", ".gcs"), ("gc_models", ".gcm"))
+
+
+class ArchiveError(ValueError):
+	pass
+
+
+class _Sink(io.RawIOBase):
+	"""Unseekable write target that hands out whatever was written since the last drain."""
+
+	def __init__(self) -> None:
+		self._chunks: List[bytes] = []
+
+	def writable(self) -> bool:
+		return True
+
+	def write(self, data) -> int:
+		self._chunks.append(bytes(data))
+		return len(data)
+
+	def drain(self) -> bytes:
+		data = b"".join(self._chunks)
+		self._chunks.clear()
+		return data
+
+
+def _ext(path: str, default: str = ".png") -> str:
+	return os.path.splitext(path)[-1].lower() or default
+
+
+def _build_manifest(db: Session, project: Project) -> Tuple[Dict[str, Any], List[Tuple[str, str]], List[Tuple[int, str, str]]]:
+	"""Manifest plus the ``(arcname, path)`` files and ``(mask_id, column, arcname)`` blobs to stream."""
+	files: List[Tuple[str, str]] = []
+	blobs: List[Tuple[int, str, str]] = []
+
+	def _file(arcname: str, path: Optional[str]) -> Optional[str]:
+		if not path or not os.path.isfile(path):
+			return None
+		files.append((arcname, path))
+		return arcname
+
+	masks_by_image: Dict[int, List[Dict[str, Any]]] = {}
+	mask_rows = (
+		db.query(Mask.id, Mask.image_id, Mask.kind, Mask.url,
+			Mask.data.isnot(None), Mask.gc_state.isnot(None), Mask.gc_models.isnot(None))
+		.join(Image).filter(Image.project_id == project.id).order_by(Mask.id)
+	)
+	for mask_id, image_id, kind, url, *present in mask_rows:
+		entry: Dict[str, Any] = {"kind": kind, "file": _file(f"masks/{mask_id}{_ext(url)}", url)}
+		for (column, suffix), has_blob in zip(_MASK_BLOBS, present):
+			entry[column] = None
+			if has_blob:
+				entry[column] = f"masks/{mask_id}{suffix}"
+				blobs.append((mask_id, column, entry[column]))
+		masks_by_image.setdefault(image_id, []).append(entry)
+
+	variants_by_image: Dict[int, List[Dict[str, Any]]] = {}
+	variant_rows = (
+		db.query(Variant.id, Variant.image_id, Variant.description, Variant.url, Variant.layers_json)
+		.join(Image).filter(Image.project_id == project.id).order_by(Variant.id)
+	)
+	for variant_id, image_id, description, url, layers_json in variant_rows:
+		variants_by_image.setdefault(image_id, []).append({
+			"description": description,
+			"file": _file(f"variants/{variant_id}{_ext(url)}", url),
+			"layers_json": layers_json,
+		})
+
+	images = []
+	image_rows = db.query(Image.id, Image.url, Image.width, Image.height, Image.exif, Image.phash).filter(Image.project_id == project.id).order_by(Image.id)
+	for image_id, url, width, height, exif, image_phash in image_rows:
+		images.append({
+			"file": _file(f"images/{image_id}{_ext(url)}", url),
+			"width": width,
+			"height": height,
+			"exif": exif,
+			"phash": phash.to_hex(image_phash) if image_phash is not None else None,
+			"masks": masks_by_image.get(image_id, []),
+			"variants": variants_by_image.get(image_id, []),
+		})
+
+	# Originals first, so a partial download is still the most useful part
+	files.sort(key=lambda item: ("images", "masks", "variants").index(item[0].split("/", 1)[0]))
+	manifest = {
+		"format": ARCHIVE_FORMAT,
+		"version": ARCHIVE_VERSION,
+		"exported_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+		"project": {"title": project.title, "created_at": project.created_at.isoformat() if project.created_at else None},
+		"images": images,
+	}
+	return manifest, files, blobs
+
+
+def _entry(arcname: str, compress: bool) -> zipfile.ZipInfo:
+	info = zipfile.ZipInfo(arcname, date_time=time.gmtime()[:6])
+	# Media is already compressed; only the manifest and mask blobs are worth deflating
+	info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+	return info
+
+
+def iter_export(project_id: int) -> Iterator[bytes]:
+	"""Yield the ZIP archive of ``project_id`` chunk by chunk.
+
+	Uses its own session: the response is streamed after the request's
+	dependencies have been torn down.
+	"""
+	sink = _Sink()
+	db = SessionLocal()
+	try:
+		project = db.query(Project).filter(Project.id == project_id).first()
+		if project is None:
+			return
+		manifest, files, blobs = _build_manifest(db, project)
+		with zipfile.ZipFile(sink, mode="w", allowZip64=True) as zf:
+			zf.writestr(_entry(MANIFEST_NAME, True), json.dumps(manifest, ensure_ascii=False, indent=1))
+			yield sink.drain()
+			for arcname, path in files:
+				try:
+					src = open(path, "rb")
+				except OSError:
+					# Deleted since the manifest was built; the entry is simply absent
+					continue
+				with src, zf.open(_entry(arcname, False), mode="w", force_zip64=True) as dst:
+					while True:
+						chunk = src.read(CHUNK_BYTES)
+						if not chunk:
+							break
+						dst.write(chunk)
+						yield sink.drain()
+				yield sink.drain()
+			for mask_id, column, arcname in blobs:
+				(blob,) = db.query(getattr(Mask, column)).filter(Mask.id == mask_id).one()
+				zf.writestr(_entry(arcname, True), blob or b"")
+				yield sink.drain()
+		yield sink.drain()
+	finally:
+		db.close()
+
+
+def _extract(zf: zipfile.ZipFile, arcname: str, subdir: str) -> Tuple[str, str]:
+	"""Copy an entry to a temporary file under ``subdir``, hashing on the way; returns ``(tmp_path, sha256)``."""
+	tmp_dir = os.path.join(BASE_MEDIA_DIR, subdir)
+	os.makedirs(tmp_dir, exist_ok=True)
+	digest = hashlib.sha256()
+	with zf.open(arcname) as src, tempfile.NamedTemporaryFile(dir=tmp_dir, suffix=".part", delete=False) as tmp:
+		while True:
+			chunk = src.read(CHUNK_BYTES)
+			if not chunk:
+				break
+			digest.update(chunk)
+			tmp.write(chunk)
+	return tmp.name, digest.hexdigest()
+
+
+def _place(tmp_path: str, sha: str, subdir: str, ext: str, user_id: int, reuse: Optional[str] = None) -> Tuple[str, bool]:
+	"""Move an extracted file to its content-addressed path unless ``user_id`` already stores identical bytes."""
+	path = os.path.join(shard_dir(subdir, sha), f"{user_id}-{sha}{ext}").replace("\\", "/")
+	for candidate in (reuse, path):
+		if candidate and os.path.isfile(candidate):
+			os.remove(tmp_path)
+			return candidate, False
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	os.replace(tmp_path, path)
+	return path, True
+
+
+def _read_blob(zf: zipfile.ZipFile, arcname: Optional[str]) -> Optional[bytes]:
+	if not arcname:
+		return None
+	try:
+		info = zf.getinfo(arcname)
+	except KeyError:
+		return None
+	if info.file_size > _BLOB_MAX_BYTES:
+		raise ArchiveError(f"{arcname} is too large")
+	return zf.read(info)
+
+
+def _probe_image(path: str) -> Dict[str, Any]:
+	"""``Image`` size and perceptual hash columns from the file itself."""
+	import cv2 as cv
+
+	# Plain decode: imports are one-off, a store sidecar per original would only fill the disk
+	image = cv.imread(path, cv.IMREAD_UNCHANGED)
+	if image is None:
+		return {"width": None, "height": None, **phash.columns(None)}
+	return {"width": image.shape[1], "height": image.shape[0], **phash.columns(phash.image_hash(image))}
+
+
+def _mask_blobs(zf: zipfile.ZipFile, entry: Dict[str, Any], shape: Optional[Tuple[int, int]]) -> Dict[str, Optional[bytes]]:
+	"""Blob columns of a manifest mask entry; blobs that do not decode to ``shape`` are dropped.
+
+	Ops decode these blobs in the API process, so nothing from an archive is
+	stored unchecked. Without a ``data`` blob the mask is read from its file;
+	without GrabCut state refinement starts over from the binary mask.
+	"""
+	blobs = {column: _read_blob(zf, entry.get(column)) for column, _ in _MASK_BLOBS}
+
+	def _fits(blob: Optional[bytes]) -> bool:
+		try:
+			return blob is not None and shape is not None and maskcodec.decode_mask(blob).shape == shape
+		except ValueError:
+			return False
+
+	if blobs["data"] is not None and not _fits(blobs["data"]):
+		blobs["data"] = None
+	if blobs["gc_state"] is not None or blobs["gc_models"] is not None:
+		try:
+			if blobs["gc_models"] is not None:
+				maskcodec.check_grabcut_models(blobs["gc_models"])
+			valid = _fits(blobs["gc_state"])
+		except ValueError:
+			valid = False
+		if not valid:
+			blobs["gc_state"] = blobs["gc_models"] = None
+	return blobs
+
+
+def _check_limits(zf: zipfile.ZipFile) -> None:
+	infos = zf.infolist()
+	if len(infos) > IMPORT_MAX_ENTRIES:
+		raise ArchiveError(f"archive has {len(infos)} entries, limit is {IMPORT_MAX_ENTRIES}")
+	# Declared sizes bound what extraction can write (zipfile enforces them while reading)
+	if sum(info.file_size for info in infos) > IMPORT_MAX_BYTES:
+		raise ArchiveError("archive is too large when extracted")
+
+
+def import_project(db: Session, user_id: int, fileobj: BinaryIO, title: Optional[str] = None) -> Dict[str, Any]:
+	"""Create a project for ``user_id`` from an archive made by ``iter_export``."""
+	try:
+		zf = zipfile.ZipFile(fileobj)
+	except zipfile.BadZipFile as exc:
+		raise ArchiveError("not a ZIP archive") from exc
+	with zf:
+		try:
+			return _import(db, user_id, zf, title)
+		except zipfile.BadZipFile as exc:
+			raise ArchiveError(f"corrupt archive: {exc}") from exc
+
+
+def _import(db: Session, user_id: int, zf: zipfile.ZipFile, title: Optional[str]) -> Dict[str, Any]:
+	_check_limits(zf)
+	try:
+		manifest = json.loads(zf.read(MANIFEST_NAME))
+	except (KeyError, ValueError) as exc:
+		raise ArchiveError("missing or invalid manifest.json") from exc
+	if manifest.get("format") != ARCHIVE_FORMAT or manifest.get("version", 0) > ARCHIVE_VERSION:
+		raise ArchiveError("unsupported archive format")
+
+	stats = {"images": 0, "masks": 0, "variants": 0, "files_written": 0, "files_deduplicated": 0, "files_missing": 0}
+
+	def _media(arcname: Optional[str], subdir: str, lookup: Optional[Callable[[str], Optional[str]]] = None) -> Tuple[Optional[str], Optional[str]]:
+		if not arcname:
+			return None, None
+		try:
+			tmp_path, sha = _extract(zf, arcname, subdir)
+		except KeyError:
+			stats["files_missing"] += 1
+			return None, None
+		path, written = _place(tmp_path, sha, subdir, _ext(arcname), user_id, lookup(sha) if lookup else None)
+		stats["files_written" if written else "files_deduplicated"] += 1
+		return path, sha
+
+	def _existing_image(sha: str) -> Optional[str]:
+		# Same bytes already in this user's projects: point at that file instead of a new copy
+		row = db.query(Image.url).join(Project).filter(Image.content_hash == sha, Project.user_id == user_id).first()
+		return row.url if row else None
+
+	project = Project(title=title or manifest.get("project", {}).get("title") or "Imported project", user_id=user_id)
+	db.add(project)
+	db.flush()
+	project_id = project.id
+
+	entries = manifest.get("images", [])
+	for start in range(0, len(entries), _INSERT_BATCH):
+		batch = entries[start:start + _INSERT_BATCH]
+		rows = []
+		for entry in batch:
+			path, sha = _media(entry.get("file"), "images", _existing_image)
+			if path is None:
+				continue
+			rows.append((entry, Image(
+				project_id=project_id, url=path, exif=entry.get("exif"), content_hash=sha, **_probe_image(path),
+			)))
+		db.add_all([image for _, image in rows])
+		db.flush()
+
+		children = []
+		for entry, image in rows:
+			for mask in entry.get("masks", []):
+				path, _ = _media(mask.get("file"), "masks")
+				if path is None:
+					continue
+				children.append(Mask(
+					image_id=image.id, kind=mask.get("kind") or "body", url=path,
+					**_mask_blobs(zf, mask, (image.height, image.width) if image.width and image.height else None),
+				))
+				stats["masks"] += 1
+			for variant in entry.get("variants", []):
+				path, _ = _media(variant.get("file"), "variants")
+				if path is None:
+					continue
+				children.append(Variant(
+					image_id=image.id, description=variant.get("description"), url=path,
+					layers_json=variant.get("layers_json"),
+				))
+				stats["variants"] += 1
+		db.add_all(children)
+		db.flush()
+		stats["images"] += len(rows)
+		# Flushed rows stay in the transaction; dropping them keeps the session small
+		db.expunge_all()
+
+	db.commit()
+	return {"project_id": project_id, **stats}
@@ -0,0 +1,121 @@
+import cv2 as cv
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# Detection runs on a copy whose long side is at most this many pixels
+DETECT_MAX_SIDE = 640
+
+
+def _default_rect(w: int, h: int) -> Tuple[int, int, int, int]:
+	# Same guess grabcut_segment has always used when no rect is given
+	return (int(0.05 * w), int(0.1 * h), int(0.9 * w), int(0.8 * h))
+
+
+def _vehicle_rect(gray: np.ndarray, body_mask: Optional[np.ndarray]) -> Tuple[int, int, int, int]:
+	h, w = gray.shape[:2]
+	if body_mask is not None and np.count_nonzero(body_mask):
+		return cv.boundingRect(body_mask.astype(np.uint8))
+
+	edges = cv.Canny(gray, 50, 150)
+	# Ignore the frame border, where crops and vignetting produce spurious edges
+	margin_x, margin_y = max(1, w // 50), max(1, h // 50)
+	edges[:margin_y] = 0
+	edges[-margin_y:] = 0
+	edges[:, :margin_x] = 0
+	edges[:, -margin_x:] = 0
+	ys, xs = np.nonzero(edges)
+	if len(xs) < 0.002 * w * h:
+		return _default_rect(w, h)
+	x0, x1 = np.percentile(xs, [2, 98])
+	y0, y1 = np.percentile(ys, [2, 98])
+	return int(x0), int(y0), int(x1 - x0) + 1, int(y1 - y0) + 1
+
+
+def _wheel_circles(gray: np.ndarray, rect: Tuple[int, int, int, int]) -> List[Tuple[float, float, float]]:
+	rx, ry, rw, rh = rect
+	if rw < 16 or rh < 16:
+		return []
+	circles = cv.HoughCircles(
+		gray, cv.HOUGH_GRADIENT, dp=1.2,
+		minDist=max(8.0, rw * 0.25),
+		param1=120, param2=30,
+		minRadius=max(4, int(rw * 0.05)),
+		maxRadius=max(8, int(rw * 0.2)),
+	)
+	if circles is None:
+		return []
+	found = []
+	# Circles are ordered by accumulator votes; keep the strongest plausible ones
+	for cx, cy, r in circles[0]:
+		inside_x = rx <= cx <= rx + rw
+		lower_body = ry + 0.45 * rh <= cy <= ry + rh + r
+		if inside_x and lower_body:
+			found.append((float(cx), float(cy), float(r)))
+		if len(found) == 4:
+			break
+	return sorted(found)
+
+
+def _clamp_rect(rect: Tuple[int, int, int, int], w: int, h: int) -> Tuple[int, int, int, int]:
+	x, y, rw, rh = rect
+	x0, y0 = max(1, x), max(1, y)
+	x1, y1 = min(w - 2, x + rw), min(h - 2, y + rh)
+	if x1 <= x0 or y1 <= y0:
+		return _default_rect(w, h)
+	return x0, y0, x1 - x0, y1 - y0
+
+
+def detect_vehicle(image_bgr: np.ndarray, body_mask: Optional[np.ndarray] = None) -> Dict[str, Any]:
+	"""Propose a vehicle bounding rect and wheel quads for an image.
+
+	``rect`` is ``[x, y, w, h]`` ready for ``grabcut_segment``; each wheel has a
+	``quad`` of four points (TL, TR, BR, BL) in the order ``overlay_wheel``
+	expects for ``dst_pts``. All coordinates are in full-resolution pixels.
+	"""
+	h, w = image_bgr.shape[:2]
+	scale = min(1.0, DETECT_MAX_SIDE / float(max(h, w)))
+	small = cv.resize(image_bgr, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA) if scale < 1.0 else image_bgr
+	gray = cv.cvtColor(small, cv.COLOR_BGR2GRAY) if small.ndim == 3 else small
+	gray = cv.medianBlur(gray, 5)
+
+	mask_small = None
+	if body_mask is not None:
+		if body_mask.ndim == 3:
+			body_mask = cv.cvtColor(body_mask, cv.COLOR_BGR2GRAY)
+		mask_small = cv.resize(body_mask, (gray.shape[1], gray.shape[0]), interpolation=cv.INTER_NEAREST) > 0
+
+	rect = _vehicle_rect(gray, mask_small)
+	circles = _wheel_circles(gray, rect)
+
+	# Wheels may stick out below a mask that excludes tyres; grow the rect to cover them
+	rx, ry, rw, rh = rect
+	for cx, cy, r in circles:
+		x0, y0 = min(rx, cx - r), min(ry, cy - r)
+		x1, y1 = max(rx + rw, cx + r), max(ry + rh, cy + r)
+		rx, ry, rw, rh = int(x0), int(y0), int(np.ceil(x1 - x0)), int(np.ceil(y1 - y0))
+
+	pad = 0.02
+	full_rect = (
+		int((rx - pad * rw) / scale), int((ry - pad * rh) / scale),
+		int(rw * (1 + 2 * pad) / scale), int(rh * (1 + 2 * pad) / scale),
+	)
+	wheels = []
+	for cx, cy, r in circles:
+		cx, cy, r = cx / scale, cy / scale, r / scale
+		wheels.append({
+			"center": [round(cx, 1), round(cy, 1)],
+			"radius": round(r, 1),
+			"quad": [
+				[round(cx - r, 1), round(cy - r, 1)],
+				[round(cx + r, 1), round(cy - r, 1)],
+				[round(cx + r, 1), round(cy + r, 1)],
+				[round(cx - r, 1), round(cy + r, 1)],
+			],
+		})
+	return {
+		"width": w,
+		"height": h,
+		"rect": list(_clamp_rect(full_rect, w, h)),
+		"wheels": wheels,
+	}
@@ -0,0 +1,83 @@
+"""Per-image cache of ``detect_vehicle`` results.
+
+Results live in a JSON sidecar next to the image (``<file>.detect.json``) so
+every worker on the node reuses them, with a small in-process LRU in front.
+An entry is valid while the image mtime and the body mask it was computed
+with are unchanged.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+DETECTION_SUFFIX = ".detect.json"
+_MAX_ENTRIES = 256
+
+_memo: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def sidecar_path(path: str) -> str:
+	return path + DETECTION_SUFFIX
+
+
+def _valid(record: Dict[str, Any], mtime_ns: int, mask_path: Optional[str]) -> bool:
+	if record.get("mtime_ns") != mtime_ns:
+		return False
+	# A detection seeded by a body mask is at least as good as one without
+	return mask_path is None or record.get("mask_path") == mask_path
+
+
+def get(path: str, mask_path: Optional[str] = None) -> Optional[Dict[str, Any]]:
+	try:
+		mtime_ns = os.stat(path).st_mtime_ns
+	except FileNotFoundError:
+		return None
+
+	with _lock:
+		record = _memo.get(path)
+		if record is not None and _valid(record, mtime_ns, mask_path):
+			_memo.move_to_end(path)
+			return record["detection"]
+
+	try:
+		with open(sidecar_path(path), "r", encoding="utf-8") as f:
+			record = json.load(f)
+	except (OSError, ValueError):
+		return None
+	if not _valid(record, mtime_ns, mask_path):
+		return None
+	_remember(path, record)
+	return record["detection"]
+
+
+def put(path: str, detection: Dict[str, Any], mask_path: Optional[str] = None) -> None:
+	from .storage import in_media_root
+
+	# Sidecars outside media/ would never be collected; those detections are simply not cached
+	if not in_media_root(path):
+		return
+	try:
+		mtime_ns = os.stat(path).st_mtime_ns
+	except FileNotFoundError:
+		return
+	record = {"mtime_ns": mtime_ns, "mask_path": mask_path, "detection": detection}
+	_remember(path, record)
+	side = sidecar_path(path)
+	tmp = f"{side}.{os.getpid()}.tmp"
+	try:
+		with open(tmp, "w", encoding="utf-8") as f:
+			json.dump(record, f)
+		os.replace(tmp, side)
+	except OSError:
+		pass
+
+
+def _remember(path: str, record: Dict[str, Any]) -> None:
+	with _lock:
+		_memo[path] = record
+		_memo.move_to_end(path)
+		while len(_memo) > _MAX_ENTRIES:
+			_memo.popitem(last=False)
@@ -0,0 +1,292 @@
+"""Process-pool execution layer for CPU-bound image ops.
+
+Ops run in one of two process pools so that long segmentations cannot starve
+the latency-sensitive recolor/overlay calls:
+
+* ``INTERACTIVE`` – recolor, overlay and other sub-second ops
+* ``HEAVY`` – GrabCut segmentation and batch work
+
+Input arrays are copied once into ``multiprocessing.shared_memory`` blocks and
+mapped by the worker; only a small descriptor ``(kind, name, shape, dtype)`` is
+pickled. Arrays served by the image store are not copied at all: the worker
+maps the same ``.npy`` sidecar, which stays pinned while the op runs, and
+decodes the source again should the sidecar be gone anyway. Results come back
+through shared memory.
+
+Progress events (see ``progress``) travel back on one queue shared by all
+workers and are fanned out to subscribers by a drain thread in the API process.
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from importlib import import_module
+from multiprocessing import shared_memory
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from . import progress
+
+if TYPE_CHECKING:
+	import numpy as np
+
+
+INTERACTIVE = "interactive"
+HEAVY = "heavy"
+
+_CPU_COUNT = os.cpu_count() or 2
+
+POOL_SIZES = {
+	INTERACTIVE: int(os.getenv("OPS_INTERACTIVE_WORKERS", str(max(1, _CPU_COUNT // 2)))),
+	HEAVY: int(os.getenv("OPS_HEAVY_WORKERS", str(max(1, _CPU_COUNT // 4)))),
+}
+# "process" in production; "inline" runs ops on a thread pool (debugging, platforms without shm)
+EXECUTOR_MODE = os.getenv("OPS_EXECUTOR", "process")
+START_METHOD = os.getenv("OPS_START_METHOD", "spawn")
+
+_SERVICES_PACKAGE = __package__
+
+_pools: Dict[str, Executor] = {}
+_pools_lock = threading.Lock()
+_progress_queue: Optional[Any] = None
+
+ArrayDescriptor = Tuple[str, str, Tuple[int, ...], str]
+
+
+def _init_worker(progress_queue: Optional[Any] = None) -> None:
+	import cv2 as cv
+
+	# Parallelism comes from the pool; nested OpenCV threads would oversubscribe the cores
+	cv.setNumThreads(1)
+	if progress_queue is not None:
+		progress.set_sink(lambda op_id, event: progress_queue.put((op_id, event)))
+
+
+def _ping() -> None:
+	pass
+
+
+def _drain_progress(queue: Any) -> None:
+	while True:
+		item = queue.get()
+		if item is None:
+			return
+		progress.hub.publish(*item)
+
+
+def _get_progress_queue(ctx: Any) -> Any:
+	global _progress_queue
+	if _progress_queue is None:
+		_progress_queue = ctx.Queue()
+		threading.Thread(target=_drain_progress, args=(_progress_queue,), name="ops-progress", daemon=True).start()
+	return _progress_queue
+
+
+def _get_pool(priority: str) -> Executor:
+	if priority not in POOL_SIZES:
+		raise ValueError(f"unknown op priority: {priority}")
+	with _pools_lock:
+		pool = _pools.get(priority)
+		if pool is None:
+			if EXECUTOR_MODE == "inline":
+				pool = ThreadPoolExecutor(max_workers=POOL_SIZES[priority], thread_name_prefix=f"ops-{priority}")
+				progress.set_sink(progress.hub.publish)
+			else:
+				ctx = multiprocessing.get_context(START_METHOD)
+				pool = ProcessPoolExecutor(
+					max_workers=POOL_SIZES[priority],
+					mp_context=ctx,
+					initializer=_init_worker,
+					initargs=(_get_progress_queue(ctx),),
+				)
+			_pools[priority] = pool
+		return pool
+
+
+def _discard_pool(priority: str, pool: Executor) -> None:
+	"""Forget a pool whose worker died; the next op on ``priority`` starts a fresh one."""
+	with _pools_lock:
+		if _pools.get(priority) is pool:
+			del _pools[priority]
+	pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _share(array: "np.ndarray", allow_sidecar: bool = True) -> Tuple[Optional[shared_memory.SharedMemory], ArrayDescriptor]:
+	import numpy as np
+	from . import image_store
+
+	sidecar = image_store.sidecar_for(array) if allow_sidecar else None
+	if sidecar is not None:
+		return None, ("npy", sidecar, tuple(array.shape), array.dtype.str)
+
+	shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+	view = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+	view[...] = array
+	del view
+	return shm, ("shm", shm.name, tuple(array.shape), array.dtype.str)
+
+
+def _load_sidecar(sidecar: str, shape: Tuple[int, ...], dtype: str) -> "np.ndarray":
+	import cv2 as cv
+	import numpy as np
+	from . import image_store
+
+	try:
+		return np.load(sidecar, mmap_mode="r", allow_pickle=False)
+	except FileNotFoundError:
+		pass
+	# Swept anyway, e.g. the op waited in the queue longer than the idle window:
+	# decode the original again rather than failing the op
+	image = cv.imread(sidecar[:-len(image_store.SIDECAR_SUFFIX)], cv.IMREAD_UNCHANGED)
+	if image is None or image.shape != tuple(shape) or image.dtype != np.dtype(dtype):
+		raise FileNotFoundError(sidecar)
+	return image
+
+
+def _attach(desc: ArrayDescriptor) -> Tuple[Optional[shared_memory.SharedMemory], "np.ndarray"]:
+	import numpy as np
+
+	kind, name, shape, dtype = desc
+	if kind == "npy":
+		return None, _load_sidecar(name, shape, dtype)
+	# Pool workers share the API process' resource tracker, so attaching here
+	# does not hand ownership to the worker; the API process unlinks every block.
+	shm = shared_memory.SharedMemory(name=name)
+	return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+
+def _release(handles: List[shared_memory.SharedMemory], unlink: bool = False) -> None:
+	for shm in handles:
+		try:
+			shm.close()
+			if unlink:
+				shm.unlink()
+		except FileNotFoundError:
+			pass
+
+
+def _run_in_worker(target: str, inputs: Dict[str, ArrayDescriptor], params: Dict[str, Any], progress_id: Optional[str] = None) -> Tuple[bool, List[Tuple[str, Any]]]:
+	import numpy as np
+
+	module_name, func_name = target.split(":")
+	func = getattr(import_module(f"{_SERVICES_PACKAGE}.{module_name}"), func_name)
+
+	handles: List[shared_memory.SharedMemory] = []
+	arrays: Dict[str, Any] = {}
+	try:
+		for key, desc in inputs.items():
+			shm, arr = _attach(desc)
+			if shm is not None:
+				handles.append(shm)
+			arrays[key] = arr
+		with progress.tracking(progress_id):
+			result = func(**arrays, **params)
+	finally:
+		arrays.clear()
+		_release(handles)
+
+	# Arrays in the result (alone or as tuple items) go back through shared memory
+	is_tuple = isinstance(result, tuple)
+	packed: List[Tuple[str, Any]] = []
+	for item in (result if is_tuple else (result,)):
+		if isinstance(item, np.ndarray):
+			out_shm, out_desc = _share(np.ascontiguousarray(item), allow_sidecar=False)
+			out_shm.close()
+			packed.append(("array", out_desc))
+		else:
+			packed.append(("value", item))
+	return is_tuple, packed
+
+
+def _collect(desc: ArrayDescriptor) -> "np.ndarray":
+	import numpy as np
+
+	shm, view = _attach(desc)
+	try:
+		return np.array(view, copy=True)
+	finally:
+		del view
+		_release([shm], unlink=True)
+
+
+def _run_inline(target: str, arrays: Dict[str, "np.ndarray"], params: Dict[str, Any], progress_id: Optional[str] = None) -> Any:
+	module_name, func_name = target.split(":")
+	func = getattr(import_module(f"{_SERVICES_PACKAGE}.{module_name}"), func_name)
+	with progress.tracking(progress_id):
+		return func(**arrays, **params)
+
+
+async def run_op(
+	target: str,
+	arrays: Optional[Dict[str, "np.ndarray"]] = None,
+	priority: str = INTERACTIVE,
+	progress_id: Optional[str] = None,
+	**params: Any,
+) -> Any:
+	"""Run ``module:function`` from the services package on the ``priority`` pool.
+
+	``arrays`` are passed to the function as keyword arguments through shared
+	memory, ``params`` are pickled as usual. The return value mirrors the
+	function's; arrays in it, alone or inside a tuple, come back through
+	shared memory and anything else is pickled. ``progress.report`` calls
+	made by the function are published under ``progress_id``.
+	"""
+	from . import image_store
+
+	arrays = arrays or {}
+	# Sidecars behind the inputs must outlive the op, not just the dispatch
+	with image_store.pinned(arrays.values()):
+		return await _run_op(target, arrays, priority, progress_id, params)
+
+
+async def _run_op(target: str, arrays: Dict[str, "np.ndarray"], priority: str, progress_id: Optional[str], params: Dict[str, Any]) -> Any:
+	loop = asyncio.get_running_loop()
+	pool = _get_pool(priority)
+
+	if EXECUTOR_MODE == "inline":
+		return await loop.run_in_executor(pool, partial(_run_inline, target, arrays, params, progress_id))
+
+	handles: List[shared_memory.SharedMemory] = []
+	try:
+		inputs: Dict[str, ArrayDescriptor] = {}
+		for key, array in arrays.items():
+			shm, desc = _share(array)
+			if shm is not None:
+				handles.append(shm)
+			inputs[key] = desc
+		is_tuple, packed = await loop.run_in_executor(pool, partial(_run_in_worker, target, inputs, params, progress_id))
+	except BrokenProcessPool:
+		from fastapi import HTTPException
+
+		# A worker was killed (OOM during GrabCut, segfault): every op on the pool fails,
+		# so replace it rather than failing all later ops too
+		_discard_pool(priority, pool)
+		raise HTTPException(status_code=503, detail="Worker crashed, retry the operation", headers={"Retry-After": "1"}) from None
+	finally:
+		_release(handles, unlink=True)
+
+	items = [_collect(value) if kind == "array" else value for kind, value in packed]
+	return tuple(items) if is_tuple else items[0]
+
+
+def prestart() -> None:
+	"""Spawn pool workers ahead of the first request."""
+	if EXECUTOR_MODE == "inline":
+		return
+	for priority, size in POOL_SIZES.items():
+		pool = _get_pool(priority)
+		for _ in range(size):
+			pool.submit(_ping)
+
+
+def shutdown() -> None:
+	global _progress_queue
+	with _pools_lock:
+		for pool in _pools.values():
+			pool.shutdown(wait=False, cancel_futures=True)
+		_pools.clear()
+	if _progress_queue is not None:
+		_progress_queue.put(None)
+		_progress_queue = None
@@ -0,0 +1,283 @@
+"""Node-local store of decoded images shared between worker processes.
+
+The first read of an image decodes it once and writes the raw pixels as a
+``.npy`` sidecar next to the original (``media/images/<id>.jpg`` ->
+``media/images/<id>.jpg.npy``). Every later read, in any worker on the node,
+maps that file read-only instead of decoding again, so all workers share the
+same page-cache pages instead of holding private copies.
+
+A sidecar is valid while its mtime equals the source file's mtime. Only
+files under the media root get one; anything else is decoded as usual.
+
+Eviction is reference counted per process: arrays handed out by
+:func:`acquire`, or passed through :func:`pinned`, are never unmapped or
+deleted by this process. Other processes see a pin as the sidecar's access
+time, which is set explicitly on every use (``relatime``/``noatime`` mounts
+barely update it on their own); the disk sweep evicts by that time and skips
+sidecars used within ``MIN_IDLE_SECONDS``. Deleting a sidecar that another
+worker still maps is safe on POSIX, since the mapping stays valid until that
+worker drops it.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, Optional
+
+if TYPE_CHECKING:
+	import numpy as np
+
+
+SIDECAR_SUFFIX = ".npy"
+
+STORE_ENABLED = os.getenv("IMAGE_STORE_ENABLED", "1") == "1"
+# Mapped arrays kept open per process
+MAX_MAPPED = int(os.getenv("IMAGE_STORE_MAX_MAPPED", "64"))
+# Total sidecar bytes kept on disk under the media root
+MAX_DISK_BYTES = int(os.getenv("IMAGE_STORE_MAX_DISK_MB", "4096")) * 1024 * 1024
+DISK_SWEEP_INTERVAL_SECONDS = 300
+# Sidecars used this recently are never swept: a pool worker may be about to map them
+MIN_IDLE_SECONDS = float(os.getenv("IMAGE_STORE_MIN_IDLE_SECONDS", "600"))
+
+
+class _Entry:
+	__slots__ = ("array", "mtime_ns", "refs")
+
+	def __init__(self, array: "np.ndarray", mtime_ns: int):
+		self.array = array
+		self.mtime_ns = mtime_ns
+		self.refs = 0
+
+
+_entries: "OrderedDict[str, _Entry]" = OrderedDict()
+_by_id: Dict[int, str] = {}
+_lock = threading.Lock()
+_last_sweep = 0.0
+
+
+def sidecar_path(path: str) -> str:
+	return path + SIDECAR_SUFFIX
+
+
+def _touch(side: str, mtime_ns: int) -> None:
+	# The mtime ties the sidecar to its source; the atime records the last use
+	try:
+		os.utime(side, ns=(time.time_ns(), mtime_ns))
+	except OSError:
+		pass
+
+
+def _write_sidecar(path: str, mtime_ns: int) -> bool:
+	import cv2 as cv
+	import numpy as np
+
+	img = cv.imread(path, cv.IMREAD_UNCHANGED)
+	if img is None:
+		return False
+	side = sidecar_path(path)
+	tmp = f"{side}.{os.getpid()}.{threading.get_ident()}.tmp{SIDECAR_SUFFIX}"
+	try:
+		np.save(tmp, np.ascontiguousarray(img), allow_pickle=False)
+		os.utime(tmp, ns=(mtime_ns, mtime_ns))
+		os.replace(tmp, side)
+	except OSError:
+		# Read-only media or full disk: the store is an optimisation, not a requirement
+		if os.path.exists(tmp):
+			os.remove(tmp)
+		return False
+	_maybe_sweep_disk()
+	return True
+
+
+def _map(path: str, mtime_ns: int) -> Optional["np.ndarray"]:
+	import numpy as np
+
+	side = sidecar_path(path)
+	try:
+		valid = os.stat(side).st_mtime_ns == mtime_ns
+	except FileNotFoundError:
+		valid = False
+	if not valid and not _write_sidecar(path, mtime_ns):
+		return None
+	try:
+		array = np.load(side, mmap_mode="r", allow_pickle=False)
+	except (OSError, ValueError):
+		return None
+	_touch(side, mtime_ns)
+	return array
+
+
+def _evict_mapped() -> None:
+	# Caller holds _lock
+	if len(_entries) <= MAX_MAPPED:
+		return
+	for key in list(_entries.keys()):
+		if len(_entries) <= MAX_MAPPED:
+			break
+		entry = _entries[key]
+		if entry.refs:
+			continue
+		del _entries[key]
+		_by_id.pop(id(entry.array), None)
+
+
+def load(path: str) -> Optional["np.ndarray"]:
+	"""Return the decoded image at ``path`` as a read-only mapped array.
+
+	Same contract as ``cv.imread(path, cv.IMREAD_UNCHANGED)``: ``None`` if the
+	file is missing or not an image.
+	"""
+	try:
+		mtime_ns = os.stat(path).st_mtime_ns
+	except FileNotFoundError:
+		return None
+	from .storage import in_media_root
+
+	if not in_media_root(path):
+		import cv2 as cv
+
+		# Paths come from clients; a sidecar outside media/ would never be swept or collected
+		return cv.imread(path, cv.IMREAD_UNCHANGED)
+
+	with _lock:
+		entry = _entries.get(path)
+		if entry is not None and entry.mtime_ns == mtime_ns:
+			_entries.move_to_end(path)
+			return entry.array
+
+	array = _map(path, mtime_ns)
+	if array is None:
+		return None
+
+	with _lock:
+		old = _entries.pop(path, None)
+		if old is not None:
+			_by_id.pop(id(old.array), None)
+		entry = _Entry(array, mtime_ns)
+		if old is not None and old.mtime_ns == mtime_ns:
+			entry.refs = old.refs
+		_entries[path] = entry
+		_by_id[id(array)] = path
+		_evict_mapped()
+	return array
+
+
+def _pin(path: str) -> Optional[_Entry]:
+	with _lock:
+		entry = _entries.get(path)
+		if entry is not None:
+			entry.refs += 1
+	if entry is not None:
+		_touch(sidecar_path(path), entry.mtime_ns)
+	return entry
+
+
+def _unpin(entry: _Entry) -> None:
+	with _lock:
+		if entry.refs:
+			entry.refs -= 1
+
+
+@contextmanager
+def acquire(path: str) -> Iterator[Optional["np.ndarray"]]:
+	"""Like :func:`load`, but pins the mapping for the duration of the block."""
+	array = load(path)
+	if array is None:
+		yield None
+		return
+	entry = _pin(path)
+	try:
+		yield array
+	finally:
+		if entry is not None:
+			_unpin(entry)
+
+
+@contextmanager
+def pinned(arrays: Iterable["np.ndarray"]) -> Iterator[None]:
+	"""Pin the store-backed arrays among ``arrays`` for the duration of the block.
+
+	Used around ops whose workers map the sidecar themselves, so neither
+	this process nor (through the touched access time) any other sweeps it
+	while the op runs.
+	"""
+	entries = []
+	for array in arrays:
+		with _lock:
+			path = _by_id.get(id(array))
+			if path is None or _entries[path].array is not array:
+				continue
+		entry = _pin(path)
+		if entry is not None:
+			entries.append(entry)
+	try:
+		yield
+	finally:
+		for entry in entries:
+			_unpin(entry)
+
+
+def sidecar_for(array: "np.ndarray") -> Optional[str]:
+	"""Sidecar file backing ``array`` if it is exactly an array handed out by the store."""
+	with _lock:
+		path = _by_id.get(id(array))
+		if path is None or _entries[path].array is not array:
+			return None
+		return sidecar_path(path)
+
+
+def _pinned_sidecars() -> set:
+	with _lock:
+		return {sidecar_path(p) for p, e in _entries.items() if e.refs}
+
+
+def sweep_disk(root: str, max_bytes: int = MAX_DISK_BYTES) -> int:
+	"""Delete least recently used sidecars under ``root`` until below ``max_bytes``.
+
+	Sidecars pinned here or used by any process within ``MIN_IDLE_SECONDS``
+	are kept even if that leaves the total above the cap. Returns the number
+	of bytes freed.
+	"""
+	sidecars = []
+	total = 0
+	for dirpath, _, filenames in os.walk(root):
+		for name in filenames:
+			if not name.endswith(SIDECAR_SUFFIX) or ".tmp" in name:
+				continue
+			full = os.path.join(dirpath, name)
+			try:
+				st = os.stat(full)
+			except FileNotFoundError:
+				continue
+			sidecars.append((st.st_atime_ns, st.st_size, full))
+			total += st.st_size
+	if total <= max_bytes:
+		return 0
+
+	pins = _pinned_sidecars()
+	idle_before = time.time_ns() - int(MIN_IDLE_SECONDS * 1e9)
+	freed = 0
+	for used_ns, size, full in sorted(sidecars):
+		if total - freed <= max_bytes or used_ns >= idle_before:
+			break
+		if full in pins:
+			continue
+		try:
+			os.remove(full)
+			freed += size
+		except FileNotFoundError:
+			pass
+	return freed
+
+
+def _maybe_sweep_disk() -> None:
+	global _last_sweep
+	from .storage import BASE_MEDIA_DIR
+
+	now = time.monotonic()
+	with _lock:
+		if now - _last_sweep < DISK_SWEEP_INTERVAL_SECONDS:
+			return
+		_last_sweep = now
+	threading.Thread(target=sweep_disk, args=(BASE_MEDIA_DIR,), name="image-store-sweep", daemon=True).start()
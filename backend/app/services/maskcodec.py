@@ -0,0 +1,159 @@
+"""Compact binary mask encoding.
+
+Masks are stored next to their ``Mask`` row as a small blob instead of being
+re-read from a full-size PNG. Two encodings are supported, both zlib-wrapped:
+
+* ``rle`` – run lengths of alternating background/foreground runs in
+  row-major order, starting with background. Best for silhouettes.
+* ``bits`` – one bit per pixel (``np.packbits``). Bounded size for noisy masks.
+
+Decoding goes straight to a boolean array without an image codec. Blobs
+can arrive from imported archives, so the header is checked against the
+payload before anything the size of the mask is allocated.
+
+The 4-state GrabCut label mask and GMM models kept for interactive refinement
+are stored the same way (:func:`encode_grabcut_state`).
+"""
+import struct
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2 as cv
+import numpy as np
+
+
+RLE = "rle"
+BITS = "bits"
+LABELS = "labels"  # uint8 label map, used for GrabCut state
+
+_MAGIC = b"AMK1"
+_HEADER = struct.Struct("<4sBII")  # magic, encoding, height, width
+_ENCODINGS = {RLE: 0, BITS: 1, LABELS: 2}
+_ENCODING_NAMES = {v: k for k, v in _ENCODINGS.items()}
+# OpenCV's decoders refuse images above this many pixels; masks follow suit
+MAX_PIXELS = 1 << 30
+# bgd + fgd GrabCut GMMs, 65 float64 values each
+GMM_VALUES = 65
+
+
+def _runs(flat: np.ndarray) -> np.ndarray:
+	change = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+	bounds = np.concatenate(([0], change, [flat.size]))
+	runs = np.diff(bounds)
+	if flat.size and flat[0]:
+		runs = np.concatenate(([0], runs))
+	return runs.astype("<u4")
+
+
+def encode_mask(mask: np.ndarray, encoding: str = RLE) -> bytes:
+	"""Encode a 2-D mask (any dtype, non-zero = foreground)."""
+	if mask.ndim == 3:
+		mask = mask[..., 0]
+	h, w = mask.shape
+	flat = np.ascontiguousarray(mask).ravel() > 0
+	if encoding == RLE:
+		payload = _runs(flat).tobytes()
+	elif encoding == BITS:
+		payload = np.packbits(flat).tobytes()
+	elif encoding == LABELS:
+		payload = np.ascontiguousarray(mask, dtype=np.uint8).tobytes()
+	else:
+		raise ValueError(f"unknown mask encoding: {encoding}")
+	return _HEADER.pack(_MAGIC, _ENCODINGS[encoding], h, w) + zlib.compress(payload, 6)
+
+
+def _inflate(data: bytes, max_length: int) -> bytes:
+	inflater = zlib.decompressobj()
+	try:
+		# max_length 0 would mean unlimited
+		payload = inflater.decompress(data, max(max_length, 1))
+	except zlib.error as exc:
+		raise ValueError(f"corrupt mask payload: {exc}") from None
+	if not inflater.eof or inflater.unconsumed_tail:
+		raise ValueError("mask payload is longer than its header allows")
+	return payload
+
+
+def decode_mask(blob: bytes) -> np.ndarray:
+	"""Decode a blob from :func:`encode_mask` into a boolean ``(h, w)`` array.
+
+	``labels`` blobs decode to the original ``uint8`` values instead. Raises
+	``ValueError`` for anything that is not a well-formed mask blob.
+	"""
+	if len(blob) < _HEADER.size:
+		raise ValueError("not an encoded mask")
+	magic, code, h, w = _HEADER.unpack_from(blob)
+	if magic != _MAGIC or code not in _ENCODING_NAMES:
+		raise ValueError("not an encoded mask")
+	pixels = h * w
+	if pixels > MAX_PIXELS:
+		raise ValueError(f"mask of {w}x{h} is too large")
+	encoding = _ENCODING_NAMES[code]
+	if encoding == RLE:
+		# At most one run per pixel plus the leading background run
+		payload = _inflate(blob[_HEADER.size:], 4 * (pixels + 1))
+		runs = np.frombuffer(payload[:len(payload) - len(payload) % 4], dtype="<u4")
+		if len(payload) % 4 or int(runs.sum(dtype=np.uint64)) != pixels:
+			raise ValueError("mask runs do not cover the frame")
+		values = np.zeros(len(runs), dtype=bool)
+		values[1::2] = True
+		flat = np.repeat(values, runs)
+	else:
+		size = pixels if encoding == LABELS else (pixels + 7) // 8
+		payload = _inflate(blob[_HEADER.size:], size)
+		if len(payload) != size:
+			raise ValueError("mask payload does not match its size")
+		if encoding == LABELS:
+			return np.frombuffer(payload, dtype=np.uint8).reshape(h, w).copy()
+		flat = np.unpackbits(np.frombuffer(payload, dtype=np.uint8), count=pixels).view(bool)
+	return flat.reshape(h, w)
+
+
+def encode_grabcut_state(state: np.ndarray, bgd: np.ndarray, fgd: np.ndarray) -> Tuple[bytes, bytes]:
+	"""Blobs for ``Mask.gc_state`` (4-state labels) and ``Mask.gc_models`` (bgd + fgd GMMs)."""
+	if state.ndim == 3:
+		state = state[..., 0]
+	if state.dtype != np.uint8:
+		state = state.astype(np.uint8)
+	models = np.concatenate([np.ravel(bgd), np.ravel(fgd)]).astype("<f8")
+	return encode_mask(state, LABELS), models.tobytes()
+
+
+def check_grabcut_models(models_blob: bytes) -> None:
+	if len(models_blob) != 2 * GMM_VALUES * 8:
+		raise ValueError("GrabCut models must be two GMMs of 65 float64 values")
+
+
+def decode_grabcut_state(state_blob: bytes, models_blob: Optional[bytes]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+	state = decode_mask(state_blob)
+	if models_blob:
+		check_grabcut_models(models_blob)
+		models = np.frombuffer(models_blob, dtype="<f8")
+		bgd, fgd = models[:GMM_VALUES].reshape(1, GMM_VALUES).copy(), models[GMM_VALUES:].reshape(1, GMM_VALUES).copy()
+	else:
+		bgd, fgd = np.zeros((1, GMM_VALUES), np.float64), np.zeros((1, GMM_VALUES), np.float64)
+	return state, bgd, fgd
+
+
+def mask_contours(mask: np.ndarray, epsilon_ratio: float = 0.002, min_area_ratio: float = 0.001) -> List[Dict[str, Any]]:
+	"""Simplified outer polygons of the mask for drawing on the client.
+
+	``epsilon_ratio`` is the Douglas-Peucker tolerance as a fraction of each
+	contour's perimeter; blobs smaller than ``min_area_ratio`` of the frame are
+	dropped. Holes are returned as separate polygons with ``"hole": true``.
+	"""
+	if mask.ndim == 3:
+		mask = mask[..., 0]
+	binary = (mask > 0).astype(np.uint8)
+	contours, hierarchy = cv.findContours(binary, cv.RETR_CCOMP, cv.CHAIN_APPROX_SIMPLE)
+	min_area = min_area_ratio * mask.shape[0] * mask.shape[1]
+	polygons = []
+	for i, contour in enumerate(contours):
+		if cv.contourArea(contour) < min_area:
+			continue
+		approx = cv.approxPolyDP(contour, epsilon_ratio * cv.arcLength(contour, True), True)
+		polygons.append({
+			"points": approx.reshape(-1, 2).tolist(),
+			"hole": bool(hierarchy[0][i][3] >= 0),
+		})
+	return polygons
@@ -0,0 +1,241 @@
+"""Media garbage collection and storage accounting.
+
+Reconciles the files under ``media/`` against the ``Image``, ``Mask`` and
+``Variant`` tables (and share snapshots against ``ProjectShare``). Files no row refers to (deleted images, cascaded masks and
+variants, op outputs and clips nobody saved) are deleted once they are older than the
+grace period, in rate-limited batches. Derived sidecars (decoded ``.npy``,
+``.detect.json``) live and die with their source file.
+
+Run a single pass by hand with::
+
+    python -m app.services.media_gc --dry-run
+"""
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Set
+
+from sqlalchemy.orm import Session
+
+from ..database import SessionLocal, Project, Image, Mask, Variant, ProjectShare
+from . import detection_cache, image_store, snapshot
+from .snapshot import SHARE_SUBDIR
+from .storage import BASE_MEDIA_DIR
+
+
+logger = logging.getLogger(__name__)
+
+MANAGED_SUBDIRS = ("images", "masks", "variants", "clips")
+SIDECAR_SUFFIXES = (image_store.SIDECAR_SUFFIX, detection_cache.DETECTION_SUFFIX)
+
+GC_GRACE_SECONDS = float(os.getenv("MEDIA_GC_GRACE_HOURS", "24")) * 3600
+GC_BATCH_SIZE = int(os.getenv("MEDIA_GC_BATCH_SIZE", "200"))
+GC_BATCH_PAUSE_SECONDS = float(os.getenv("MEDIA_GC_BATCH_PAUSE_SECONDS", "1.0"))
+GC_INTERVAL_SECONDS = float(os.getenv("MEDIA_GC_INTERVAL_SECONDS", "3600"))
+_LOCK_FILE = os.path.join(BASE_MEDIA_DIR, ".gc.lock")
+
+_gc_thread: Optional[threading.Thread] = None
+
+
+def _normalize(path: str) -> str:
+	return os.path.normpath(path).replace("\\", "/")
+
+
+def _source_of(path: str) -> str:
+	for suffix in SIDECAR_SUFFIXES:
+		if path.endswith(suffix):
+			return path[: -len(suffix)]
+	return path
+
+
+def referenced_paths(db: Session) -> Set[str]:
+	referenced: Set[str] = set()
+	for model in (Image, Mask, Variant):
+		for (url,) in db.query(model.url).yield_per(5000):
+			if url:
+				referenced.add(_normalize(url))
+	return referenced
+
+
+def find_orphans(db: Session, grace_seconds: float = GC_GRACE_SECONDS, now: Optional[float] = None) -> Iterator[str]:
+	now = time.time() if now is None else now
+	referenced = referenced_paths(db)
+	for subdir in MANAGED_SUBDIRS:
+		for dirpath, _, filenames in os.walk(os.path.join(BASE_MEDIA_DIR, subdir)):
+			for name in filenames:
+				path = _normalize(os.path.join(dirpath, name))
+				if _source_of(path) in referenced:
+					continue
+				try:
+					age = now - os.stat(path).st_mtime
+				except FileNotFoundError:
+					continue
+				if age >= grace_seconds:
+					yield path
+
+
+def find_orphan_snapshots(db: Session, grace_seconds: float = GC_GRACE_SECONDS, now: Optional[float] = None) -> Iterator[str]:
+	now = time.time() if now is None else now
+	root = os.path.join(BASE_MEDIA_DIR, SHARE_SUBDIR)
+	if not os.path.isdir(root):
+		return
+	versions = dict(db.query(ProjectShare.slug, ProjectShare.snapshot_version))
+	for entry in os.scandir(root):
+		if not entry.is_dir():
+			continue
+		if entry.name not in versions:
+			if now - entry.stat().st_mtime >= grace_seconds:
+				yield entry.path
+			continue
+		# Live share: versions superseded by a re-publish
+		yield from snapshot.stale_versions(entry.name, versions[entry.name], max(grace_seconds, snapshot.SNAPSHOT_GRACE_SECONDS), now)
+
+
+def _prune_empty_dirs() -> None:
+	for subdir in MANAGED_SUBDIRS:
+		root = os.path.join(BASE_MEDIA_DIR, subdir)
+		for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+			if dirpath != root and not dirnames and not filenames:
+				try:
+					os.rmdir(dirpath)
+				except OSError:
+					pass
+
+
+def collect(
+	db: Session,
+	dry_run: bool = False,
+	grace_seconds: float = GC_GRACE_SECONDS,
+	batch_size: int = GC_BATCH_SIZE,
+	batch_pause: float = GC_BATCH_PAUSE_SECONDS,
+) -> Dict[str, int]:
+	"""Delete orphaned media files; returns ``{"files": n, "bytes": n}``."""
+	stats = {"files": 0, "bytes": 0}
+	in_batch = 0
+	for path in find_orphans(db, grace_seconds):
+		try:
+			size = os.path.getsize(path)
+			if not dry_run:
+				os.remove(path)
+		except FileNotFoundError:
+			continue
+		stats["files"] += 1
+		stats["bytes"] += size
+		in_batch += 1
+		if in_batch >= batch_size:
+			in_batch = 0
+			# Keep the disk free for request traffic between batches
+			time.sleep(batch_pause)
+	for path in find_orphan_snapshots(db, grace_seconds):
+		size = snapshot.path_bytes(path)
+		if not dry_run:
+			snapshot.remove_path(path)
+		stats["files"] += 1
+		stats["bytes"] += size
+	if not dry_run:
+		_prune_empty_dirs()
+	return stats
+
+
+def _file_bytes(path: Optional[str]) -> Dict[str, int]:
+	if not path:
+		return {"bytes": 0, "cache_bytes": 0}
+	sizes = {"bytes": 0, "cache_bytes": 0}
+	try:
+		sizes["bytes"] = os.path.getsize(path)
+	except OSError:
+		pass
+	for suffix in SIDECAR_SUFFIXES:
+		try:
+			sizes["cache_bytes"] += os.path.getsize(path + suffix)
+		except OSError:
+			pass
+	return sizes
+
+
+def _storage(db: Session, project_ids: List[int]) -> Dict[str, int]:
+	totals = {"images_bytes": 0, "masks_bytes": 0, "variants_bytes": 0, "cache_bytes": 0}
+	queries = (
+		("images_bytes", db.query(Image.url).filter(Image.project_id.in_(project_ids))),
+		("masks_bytes", db.query(Mask.url).join(Image).filter(Image.project_id.in_(project_ids))),
+		("variants_bytes", db.query(Variant.url).join(Image).filter(Image.project_id.in_(project_ids))),
+	)
+	seen: Set[str] = set()
+	for key, query in queries:
+		for (url,) in query.distinct():
+			# Deduplicated uploads and imports share one file between rows; it is stored once
+			if url in seen:
+				continue
+			seen.add(url)
+			sizes = _file_bytes(url)
+			totals[key] += sizes["bytes"]
+			totals["cache_bytes"] += sizes["cache_bytes"]
+	totals["total_bytes"] = sum(totals.values())
+	return totals
+
+
+def project_storage(db: Session, project_id: int) -> Dict[str, int]:
+	return _storage(db, [project_id])
+
+
+def user_storage(db: Session, user_id: int) -> Dict[str, object]:
+	project_ids = [project_id for (project_id,) in db.query(Project.id).filter(Project.user_id == user_id)]
+	projects = [{"project_id": project_id, **project_storage(db, project_id)} for project_id in project_ids]
+	# Files shared between the user's projects count once in the total
+	return {"total_bytes": _storage(db, project_ids)["total_bytes"], "projects": projects}
+
+
+def _run_locked_pass() -> Optional[Dict[str, int]]:
+	# Only one worker on the node collects at a time
+	os.makedirs(BASE_MEDIA_DIR, exist_ok=True)
+	with open(_LOCK_FILE, "a") as lock:
+		try:
+			import fcntl
+
+			fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+		except ImportError:
+			pass
+		except OSError:
+			return None
+		db = SessionLocal()
+		try:
+			return collect(db)
+		finally:
+			db.close()
+
+
+def _gc_loop() -> None:
+	while True:
+		try:
+			stats = _run_locked_pass()
+			if stats:
+				logger.info("media gc removed %(files)d file(s), %(bytes)d bytes", stats)
+		except Exception:
+			logger.exception("media gc pass failed")
+		time.sleep(GC_INTERVAL_SECONDS)
+
+
+def start_background_gc() -> None:
+	global _gc_thread
+	if _gc_thread is not None:
+		return
+	_gc_thread = threading.Thread(target=_gc_loop, name="media-gc", daemon=True)
+	_gc_thread.start()
+
+
+if __name__ == "__main__":
+	import argparse
+
+	parser = argparse.ArgumentParser(description="Delete media files no longer referenced by the database")
+	parser.add_argument("--dry-run", action="store_true")
+	parser.add_argument("--grace-hours", type=float, default=GC_GRACE_SECONDS / 3600)
+	args = parser.parse_args()
+
+	session = SessionLocal()
+	try:
+		result = collect(session, dry_run=args.dry_run, grace_seconds=args.grace_hours * 3600)
+	finally:
+		session.close()
+	verb = "would remove" if args.dry_run else "removed"
+	print(f"{verb} {result['files']} file(s), {result['bytes']} bytes")
@@ -1,15 +1,42 @@
 import cv2 as cv
 import numpy as np
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
+from .tiling import should_tile, strip_height, iter_strips, allocate_output
 
-def overlay_wheel(base_bgr: np.ndarray, wheel_bgra: np.ndarray, src_pts: List[Tuple[float, float]], dst_pts: List[Tuple[float, float]]) -> np.ndarray:
-	H, status = cv.findHomography(np.array(src_pts, dtype=np.float32), np.array(dst_pts, dtype=np.float32))
-	h, w = base_bgr.shape[:2]
-	warped = cv.warpPerspective(wheel_bgra, H, (w, h), flags=cv.INTER_LINEAR, borderMode=cv.BORDER_TRANSPARENT)
+
+# Transient bytes per pixel while compositing: warped BGRA, float alpha,
+# float base, float wheel and the float blend
+_OVERLAY_BYTES_PER_PIXEL = 48
+
+
+def _composite(base_bgr: np.ndarray, warped: np.ndarray) -> np.ndarray:
 	alpha = warped[..., 3:4] / 255.0
 	base = base_bgr.astype(np.float32)
 	wheel_rgb = warped[..., :3].astype(np.float32)
-	result = (base * (1.0 - alpha) + wheel_rgb * alpha).astype(np.uint8)
-	return result
+	return (base * (1.0 - alpha) + wheel_rgb * alpha).astype(np.uint8)
+
+
+def overlay_wheel(base_bgr: np.ndarray, wheel_bgra: np.ndarray, src_pts: List[Tuple[float, float]], dst_pts: List[Tuple[float, float]], out: Optional[np.ndarray] = None) -> np.ndarray:
+	H, status = cv.findHomography(np.array(src_pts, dtype=np.float32), np.array(dst_pts, dtype=np.float32))
+	h, w = base_bgr.shape[:2]
+	if out is None and not should_tile(base_bgr.shape):
+		warped = cv.warpPerspective(wheel_bgra, H, (w, h), flags=cv.INTER_LINEAR, borderMode=cv.BORDER_TRANSPARENT)
+		return _composite(base_bgr, warped)
 
+	# Large frames: warp and blend one strip at a time; strips the wheel does not
+	# reach are copied through untouched
+	if out is None:
+		out = allocate_output(base_bgr.shape, base_bgr.dtype)
+	ys = [p[1] for p in dst_pts]
+	top, bottom = int(np.floor(min(ys))), int(np.ceil(max(ys))) + 1
+	rows = strip_height(w, _OVERLAY_BYTES_PER_PIXEL)
+	for y0, y1 in iter_strips(h, rows):
+		if y1 <= top or y0 >= bottom:
+			out[y0:y1] = base_bgr[y0:y1]
+			continue
+		shift = np.array([[1, 0, 0], [0, 1, -y0], [0, 0, 1]], dtype=np.float64)
+		warped = np.zeros((y1 - y0, w, wheel_bgra.shape[2]), dtype=wheel_bgra.dtype)
+		cv.warpPerspective(wheel_bgra, shift @ H, (w, y1 - y0), dst=warped, flags=cv.INTER_LINEAR, borderMode=cv.BORDER_TRANSPARENT)
+		out[y0:y1] = _composite(base_bgr[y0:y1], warped)
+	return out
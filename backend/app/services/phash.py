@@ -0,0 +1,201 @@
+"""Perceptual hashes for duplicate and near-duplicate photo lookup.
+
+Every uploaded original gets a 64-bit DCT hash (pHash): the image is reduced
+to 32x32 grey, the lowest 8x8 DCT frequencies are compared with their
+median, one bit each. Re-encoding, resizing and small tone changes flip only
+a few bits, so the Hamming distance between two hashes says how alike the
+photos are.
+
+Lookup is multi-index hashing instead of an in-memory BK-tree: the hash is
+split into four 16-bit bands, each stored in its own indexed column. Two
+hashes within distance ``d`` must agree on some band to within ``d // 4``
+bits (pigeonhole), so a query only probes each band index for its value and
+the few values that many bits away, then checks the exact distance on the
+rows that come back. Lookups are always scoped to one user's images. Real
+photos cluster (same car, same framing), so a bucket can still hold many
+rows; candidates are capped, best-matching bands first, and a lookup that
+hit the cap says so. The index lives in the database, so every worker
+shares it and it costs nothing at startup, however many images are stored.
+
+Backfill rows stored before the hash existed with::
+
+    python -m app.services.phash --backfill
+"""
+import os
+from itertools import combinations
+from typing import TYPE_CHECKING, Any, Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import case, or_
+from sqlalchemy.orm import Session
+
+from ..database import Image, Project
+
+if TYPE_CHECKING:
+	import numpy as np
+
+
+HASH_BITS = 64
+BANDS = 4
+BAND_BITS = HASH_BITS // BANDS
+# Distance at which an upload counts as the same photo and reuses masks / detections
+NEAR_DUPLICATE_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "6"))
+# Widest search a query may ask for: up to 2 flipped bits probed per band
+MAX_SEARCH_DISTANCE = BANDS * 3 - 1
+# Rows fetched per lookup before exact distances are checked
+MAX_CANDIDATES = int(os.getenv("PHASH_MAX_CANDIDATES", "2000"))
+
+_MASK64 = (1 << HASH_BITS) - 1
+_BAND_MASK = (1 << BAND_BITS) - 1
+_BAND_COLUMNS = tuple(getattr(Image, f"phash_b{i}") for i in range(BANDS))
+_flips: Dict[int, List[int]] = {}
+
+
+def image_hash(image: "np.ndarray") -> int:
+	"""Unsigned 64-bit pHash of a decoded image (grey, BGR or BGRA, any depth)."""
+	import cv2 as cv
+	import numpy as np
+
+	if image.ndim == 3:
+		image = cv.cvtColor(image, cv.COLOR_BGRA2GRAY if image.shape[2] == 4 else cv.COLOR_BGR2GRAY)
+	small = cv.resize(image, (32, 32), interpolation=cv.INTER_AREA).astype(np.float32)
+	low = cv.dct(small)[:8, :8].flatten()
+	# The DC term only tracks overall brightness, so it does not set the threshold
+	bits = low > np.median(low[1:])
+	return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def to_hex(value: int) -> str:
+	return f"{value & _MASK64:016x}"
+
+
+def from_hex(text: Optional[str]) -> Optional[int]:
+	if not text:
+		return None
+	try:
+		value = int(text, 16)
+	except (TypeError, ValueError):
+		return None
+	return value if 0 <= value <= _MASK64 else None
+
+
+def distance(a: int, b: int) -> int:
+	return bin((a ^ b) & _MASK64).count("1")
+
+
+def bands(value: int) -> List[int]:
+	return [(value >> (BAND_BITS * i)) & _BAND_MASK for i in range(BANDS)]
+
+
+def columns(value: Optional[int]) -> Dict[str, Optional[int]]:
+	"""``Image`` column values for a hash; the full hash is stored as a signed BIGINT."""
+	if value is None:
+		return {"phash": None, **{f"phash_b{i}": None for i in range(BANDS)}}
+	value &= _MASK64
+	signed = value - (1 << HASH_BITS) if value >> (HASH_BITS - 1) else value
+	return {"phash": signed, **{f"phash_b{i}": band for i, band in enumerate(bands(value))}}
+
+
+def _flip_masks(radius: int) -> List[int]:
+	masks = _flips.get(radius)
+	if masks is None:
+		masks = [0]
+		for r in range(1, radius + 1):
+			for positions in combinations(range(BAND_BITS), r):
+				masks.append(sum(1 << p for p in positions))
+		_flips[radius] = masks
+	return masks
+
+
+class Similar(NamedTuple):
+	matches: List[Tuple[Any, int]]
+	# The candidate cap was hit: closer matches may exist among the rows not fetched
+	truncated: bool
+
+
+def find_similar(
+	db: Session,
+	value: int,
+	user_id: int,
+	max_distance: int = NEAR_DUPLICATE_DISTANCE,
+	exclude_id: Optional[int] = None,
+	limit: int = 20,
+) -> Similar:
+	"""The user's images within ``max_distance`` bits of ``value``, closest first, as ``(row, distance)``.
+
+	Rows carry ``id, project_id, url, width, height, content_hash, phash``.
+	Candidates are scoped to the user's projects before the cap and ranked
+	by how many bands match exactly, so when a crowded bucket (real photos
+	cluster) exceeds ``MAX_CANDIDATES`` the rows dropped are the least
+	likely matches, and ``truncated`` says so.
+	"""
+	max_distance = max(0, min(max_distance, MAX_SEARCH_DISTANCE))
+	flips = _flip_masks(max_distance // BANDS)
+	value_bands = bands(value)
+	probes = [column.in_([band ^ mask for mask in flips]) for column, band in zip(_BAND_COLUMNS, value_bands)]
+	exact_bands = sum(case((column == band, 1), else_=0) for column, band in zip(_BAND_COLUMNS, value_bands))
+	project_ids = [pid for (pid,) in db.query(Project.id).filter(Project.user_id == user_id)]
+	if not project_ids:
+		return Similar([], False)
+	# Bands and project ids together hit the (band, project_id) indexes
+	query = db.query(
+		Image.id, Image.project_id, Image.url, Image.width, Image.height, Image.content_hash, Image.phash,
+	).filter(Image.project_id.in_(project_ids), or_(*probes))
+	if exclude_id is not None:
+		query = query.filter(Image.id != exclude_id)
+	rows = query.order_by(exact_bands.desc(), Image.id).limit(MAX_CANDIDATES + 1).all()
+
+	matches = []
+	for row in rows[:MAX_CANDIDATES]:
+		d = distance(value, row.phash)
+		if d <= max_distance:
+			matches.append((row, d))
+	matches.sort(key=lambda item: (item[1], item[0].id))
+	return Similar(matches[:limit], len(rows) > MAX_CANDIDATES)
+
+
+def backfill(db: Session, batch_size: int = 500) -> Dict[str, int]:
+	"""Hash stored originals that have no ``phash`` yet; unreadable files are skipped."""
+	import cv2 as cv
+
+	stats = {"hashed": 0, "unreadable": 0}
+	last_id = 0
+	while True:
+		rows = (
+			db.query(Image.id, Image.url)
+			.filter(Image.phash.is_(None), Image.id > last_id)
+			.order_by(Image.id)
+			.limit(batch_size)
+			.all()
+		)
+		if not rows:
+			return stats
+		for image_id, url in rows:
+			# Plain decode: going through the image store would leave a .npy behind for every file
+			image = cv.imread(url, cv.IMREAD_UNCHANGED) if url and os.path.exists(url) else None
+			if image is None:
+				stats["unreadable"] += 1
+				continue
+			db.query(Image).filter(Image.id == image_id).update(columns(image_hash(image)), synchronize_session=False)
+			stats["hashed"] += 1
+		db.commit()
+		last_id = rows[-1].id
+
+
+if __name__ == "__main__":
+	import argparse
+
+	from ..database import SessionLocal
+
+	parser = argparse.ArgumentParser(description="Perceptual hash index maintenance")
+	parser.add_argument("--backfill", action="store_true", help="Hash images stored before the index existed")
+	parser.add_argument("--batch-size", type=int, default=500)
+	args = parser.parse_args()
+	if not args.backfill:
+		parser.error("nothing to do; pass --backfill")
+
+	session = SessionLocal()
+	try:
+		result = backfill(session, batch_size=args.batch_size)
+	finally:
+		session.close()
+	print(f"hashed {result['hashed']} image(s), {result['unreadable']} unreadable")
@@ -0,0 +1,198 @@
+"""Progress reporting for long-running ops.
+
+Op functions call ``report(stage, ...)`` wherever they have something to
+say (a GrabCut iteration finished, a strip or frame is done, a low-res
+preview is ready). It is a no-op unless the op is being tracked, so the
+services stay usable on their own. Pool workers send events back to the API
+process through a queue handed to them at spawn time; inline ops publish
+directly.
+
+In the API process, ``hub`` keeps one channel per client-chosen progress id:
+a short history for late subscribers plus the live subscriber queues that
+``GET /ops/progress/{id}`` streams from. A channel ends with a ``result`` or
+``error`` event and is dropped shortly after.
+
+Channels live in one API process. With several API workers the stream and
+the op must reach the same one (sticky routing on the progress id, or a
+single worker); a channel that no op in this process claims is ended with an
+``error`` event after ``OPS_PROGRESS_CLAIM_SECONDS``.
+"""
+import asyncio
+import base64
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Deque, Dict, Iterator, List, Optional
+
+if TYPE_CHECKING:
+	import numpy as np
+
+
+PREVIEW_MAX_SIDE = 256
+_HISTORY_EVENTS = 32
+_FINISHED_TTL_SECONDS = 60.0
+_IDLE_TTL_SECONDS = 600.0
+
+# Where report() sends events in this process: the worker queue or the hub
+_sink: Optional[Callable[[str, Dict[str, Any]], None]] = None
+_local = threading.local()
+
+
+def set_sink(sink: Optional[Callable[[str, Dict[str, Any]], None]]) -> None:
+	global _sink
+	_sink = sink
+
+
+@contextmanager
+def tracking(op_id: Optional[str]) -> Iterator[None]:
+	"""Attribute ``report`` calls on this thread to ``op_id`` for the duration of an op."""
+	previous = getattr(_local, "op_id", None)
+	_local.op_id = op_id
+	try:
+		yield
+	finally:
+		_local.op_id = previous
+
+
+def active() -> bool:
+	"""Whether anyone is listening; lets ops skip work that only feeds progress."""
+	return _sink is not None and getattr(_local, "op_id", None) is not None
+
+
+def preview_jpeg(image: "np.ndarray", max_side: int = PREVIEW_MAX_SIDE) -> str:
+	import cv2 as cv
+
+	h, w = image.shape[:2]
+	scale = min(1.0, max_side / float(max(h, w)))
+	if scale < 1.0:
+		image = cv.resize(image, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv.INTER_AREA)
+	ok, buf = cv.imencode(".jpg", image, [cv.IMWRITE_JPEG_QUALITY, 80])
+	return "data:image/jpeg;base64," + base64.b64encode(buf.tobytes()).decode("ascii") if ok else ""
+
+
+def report(stage: str, done: Optional[int] = None, total: Optional[int] = None, preview: Optional["np.ndarray"] = None, **fields: Any) -> None:
+	if not active():
+		return
+	event: Dict[str, Any] = {"stage": stage, **fields}
+	if done is not None:
+		event["done"] = done
+	if total is not None:
+		event["total"] = total
+	if preview is not None:
+		# Encoded where the pixels are, so only a few KB cross the process boundary
+		event["preview"] = preview_jpeg(preview)
+	_sink(_local.op_id, event)
+
+
+class _Channel:
+	def __init__(self, user_id: int, loop: asyncio.AbstractEventLoop):
+		self.user_id = user_id
+		self.loop = loop
+		self.history: Deque[Dict[str, Any]] = deque(maxlen=_HISTORY_EVENTS)
+		self.subscribers: List["asyncio.Queue[Dict[str, Any]]"] = []
+		self.finished_at: Optional[float] = None
+		self.touched = time.monotonic()
+		# An op request in this process uses the channel; a subscriber alone does not count
+		self.claimed = False
+
+
+class Hub:
+	def __init__(self) -> None:
+		self._channels: Dict[str, _Channel] = {}
+		self._lock = threading.Lock()
+
+	def _expire(self, now: float) -> None:
+		for op_id, channel in list(self._channels.items()):
+			finished = channel.finished_at is not None and now - channel.finished_at > _FINISHED_TTL_SECONDS
+			if finished or (not channel.subscribers and now - channel.touched > _IDLE_TTL_SECONDS):
+				del self._channels[op_id]
+
+	def open(self, op_id: str, user_id: int, claim: bool = False) -> bool:
+		"""Create or join the channel ``op_id``; False if another user owns it.
+
+		Ops pass ``claim=True``, which tells subscribers the op runs in this process.
+		"""
+		now = time.monotonic()
+		with self._lock:
+			self._expire(now)
+			channel = self._channels.get(op_id)
+			if channel is None:
+				channel = self._channels[op_id] = _Channel(user_id, asyncio.get_running_loop())
+			channel.touched = now
+			if channel.user_id != user_id:
+				return False
+			channel.claimed = channel.claimed or claim
+			return True
+
+	def claimed(self, op_id: str) -> bool:
+		with self._lock:
+			channel = self._channels.get(op_id)
+			return channel is not None and channel.claimed
+
+	def publish(self, op_id: str, event: Dict[str, Any], final: bool = False) -> None:
+		"""Thread-safe; events for unknown or finished channels are dropped."""
+		event = {**event, "ts": round(time.time(), 3)}
+		if final:
+			event["final"] = True
+		with self._lock:
+			channel = self._channels.get(op_id)
+			if channel is None or channel.finished_at is not None:
+				return
+			channel.history.append(event)
+			channel.touched = time.monotonic()
+			if final:
+				channel.finished_at = channel.touched
+			for queue in channel.subscribers:
+				channel.loop.call_soon_threadsafe(queue.put_nowait, event)
+
+	def subscribe(self, op_id: str, user_id: int) -> Optional["asyncio.Queue[Dict[str, Any]]"]:
+		"""Queue pre-filled with the channel history, then live events; None if not the owner's."""
+		if not self.open(op_id, user_id):
+			return None
+		queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+		with self._lock:
+			channel = self._channels[op_id]
+			for event in channel.history:
+				queue.put_nowait(event)
+			channel.subscribers.append(queue)
+		return queue
+
+	def unsubscribe(self, op_id: str, queue: "asyncio.Queue[Dict[str, Any]]") -> None:
+		with self._lock:
+			channel = self._channels.get(op_id)
+			if channel is not None and queue in channel.subscribers:
+				channel.subscribers.remove(queue)
+
+
+hub = Hub()
+
+
+class Tracker:
+	"""Router-side handle on one progress channel; every method is a no-op without an id."""
+
+	def __init__(self, op_id: Optional[str] = None):
+		self.id = op_id
+
+	def stage(self, stage: str, **fields: Any) -> None:
+		if self.id:
+			hub.publish(self.id, {"stage": stage, **fields})
+
+	async def run(self, awaitable: Awaitable[Any]) -> Any:
+		"""Await the op and close the channel with its result or error."""
+		from fastapi import HTTPException
+		from fastapi.encoders import jsonable_encoder
+
+		try:
+			result = await awaitable
+		except HTTPException as exc:
+			if self.id:
+				hub.publish(self.id, {"stage": "error", "status": exc.status_code, "detail": exc.detail}, final=True)
+			raise
+		except Exception:
+			if self.id:
+				hub.publish(self.id, {"stage": "error", "status": 500, "detail": "Internal Server Error"}, final=True)
+			raise
+		if self.id:
+			hub.publish(self.id, {"stage": "result", "result": jsonable_encoder(result)}, final=True)
+		return result
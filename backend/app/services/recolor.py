@@ -1,10 +1,17 @@
 import cv2 as cv
 import numpy as np
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
+from . import progress
+from .tiling import should_tile, strip_height, iter_strips, allocate_output
 
-def recolor_hsv(image_bgr: np.ndarray, mask: np.ndarray, dh: int = 0, ds: float = 0.0, dv: float = 0.0) -> np.ndarray:
-	if mask.ndim == 3:
-		mask = cv.cvtColor(mask, cv.COLOR_BGR2GRAY)
+
+# Transient bytes per pixel of _recolor_block: float32 HSV, its split planes and
+# the merged copy (3 x 12), plus uint8 HSV, recolored BGR and the 3-channel mask
+_RECOLOR_BYTES_PER_PIXEL = 48
+
+
+def _recolor_block(image_bgr: np.ndarray, mask: np.ndarray, dh: int, ds: float, dv: float) -> np.ndarray:
 	mask_bin = (mask > 0).astype(np.uint8) * 255
 	hsv = cv.cvtColor(image_bgr, cv.COLOR_BGR2HSV).astype(np.float32)
 	h, s, v = cv.split(hsv)
@@ -17,3 +24,133 @@ def recolor_hsv(image_bgr: np.ndarray, mask: np.ndarray, dh: int = 0, ds: float
 	out = np.where(mask3 > 0, recolored, image_bgr)
 	return out
 
+
+def recolor_hsv(image_bgr: np.ndarray, mask: np.ndarray, dh: int = 0, ds: float = 0.0, dv: float = 0.0, out: Optional[np.ndarray] = None) -> np.ndarray:
+	if mask.ndim == 3:
+		mask = cv.cvtColor(mask, cv.COLOR_BGR2GRAY)
+	if out is None and not should_tile(image_bgr.shape):
+		return _recolor_block(image_bgr, mask, dh, ds, dv)
+
+	# Large frames: bounded working memory, results written straight into `out`
+	height, width = image_bgr.shape[:2]
+	if out is None:
+		out = allocate_output(image_bgr.shape, image_bgr.dtype)
+	rows = strip_height(width, _RECOLOR_BYTES_PER_PIXEL)
+	for y0, y1 in iter_strips(height, rows):
+		out[y0:y1] = _recolor_block(image_bgr[y0:y1], mask[y0:y1], dh, ds, dv)
+		progress.report("recolor", done=y1, total=height)
+	return out
+
+
+def parse_hex_color(color: str) -> Tuple[int, int, int]:
+	"""``"#rrggbb"`` -> ``(b, g, r)``."""
+	value = color.lstrip("#")
+	r, g, b = int(value[0:2], 16), int(value[2:4], 16), int(value[4:6], 16)
+	return b, g, r
+
+
+def _mean_hue(hue: np.ndarray) -> float:
+	"""Circular mean of OpenCV hues (0-180 wraps): reds near 2 and 178 average to red, not cyan."""
+	angle = hue.astype(np.float64) * (np.pi / 90.0)
+	mean = np.arctan2(np.sin(angle).mean(), np.cos(angle).mean())
+	return float(mean * (90.0 / np.pi)) % 180.0
+
+
+def swatch_params(swatch: Dict[str, Any], hsv_px: np.ndarray) -> Tuple[float, float, float]:
+	"""``dh/ds/dv`` for a swatch; a ``color`` target is resolved against the body's ``(N, 3)`` HSV pixels."""
+	if not swatch.get("color"):
+		return float(swatch.get("dh", 0)), float(swatch.get("ds", 0.0)), float(swatch.get("dv", 0.0))
+	# Shift the typical body colour onto the target and keep the per-pixel shading
+	target = cv.cvtColor(np.uint8([[parse_hex_color(swatch["color"])]]), cv.COLOR_BGR2HSV)[0, 0].astype(np.float32)
+	if len(hsv_px) == 0:
+		return 0.0, 0.0, 0.0
+	med_h = _mean_hue(hsv_px[:, 0])
+	med_s, med_v = np.median(hsv_px[:, 1:], axis=0)
+	dh = (target[0] - med_h + 90) % 180 - 90
+	ds = target[1] / max(med_s, 1.0) - 1.0
+	dv = target[2] / max(med_v, 1.0) - 1.0
+	return float(dh), float(ds), float(dv)
+
+
+# Transient bytes per pixel of one _render strip: uint8 HSV, pixel index, float32
+# masked HSV, and per swatch the float planes, their stack and the uint8/BGR copies
+_RENDER_BYTES_PER_PIXEL = 64
+
+
+def _recolor_pixels(hsv_px: np.ndarray, dh: float, ds: float, dv: float) -> np.ndarray:
+	"""Recolor ``(N, 3)`` float HSV pixels for one swatch -> ``(N, 3)`` BGR."""
+	h = (hsv_px[:, 0] + dh) % 180
+	s = np.clip(hsv_px[:, 1] * (1.0 + ds), 0, 255)
+	v = np.clip(hsv_px[:, 2] * (1.0 + dv), 0, 255)
+	hsv2 = np.stack([h, s, v], axis=-1).astype(np.uint8)
+	return cv.cvtColor(hsv2.reshape(1, -1, 3), cv.COLOR_HSV2BGR).reshape(-1, 3)
+
+
+def _render(image_bgr: np.ndarray, mask_bool: np.ndarray, params: np.ndarray) -> np.ndarray:
+	"""``(S, h, w, 3)`` renders, one swatch at a time over strips sized by the tile budget.
+
+	Each strip is converted to HSV once and shared by every swatch; only masked
+	pixels are recolored, so working memory stays bounded whatever S and the
+	frame size are. The output itself is the only full-frame allocation.
+	"""
+	h, w = image_bgr.shape[:2]
+	out = np.empty((len(params), h, w, 3), np.uint8)
+	for y0, y1 in iter_strips(h, strip_height(w, _RENDER_BYTES_PER_PIXEL)):
+		block = np.ascontiguousarray(image_bgr[y0:y1]).reshape(-1, 3)
+		idx = np.flatnonzero(mask_bool[y0:y1])
+		hsv_px = cv.cvtColor(block.reshape(1, -1, 3), cv.COLOR_BGR2HSV).reshape(-1, 3)[idx].astype(np.float32)
+		for k, (dh, ds, dv) in enumerate(params):
+			strip = out[k, y0:y1].reshape(-1, 3)
+			strip[:] = block
+			if len(idx):
+				strip[idx] = _recolor_pixels(hsv_px, dh, ds, dv)
+	return out
+
+
+def _contact_sheet(previews: np.ndarray, columns: int, gap: int = 4) -> np.ndarray:
+	count, ph, pw = previews.shape[:3]
+	columns = max(1, min(columns, count))
+	rows = (count + columns - 1) // columns
+	sheet = np.full((rows * ph + (rows + 1) * gap, columns * pw + (columns + 1) * gap, 3), 255, np.uint8)
+	for i, preview in enumerate(previews):
+		r, c = divmod(i, columns)
+		y, x = gap + r * (ph + gap), gap + c * (pw + gap)
+		sheet[y:y + ph, x:x + pw] = preview
+	return sheet
+
+
+def recolor_palette(
+	image_bgr: np.ndarray,
+	mask: np.ndarray,
+	swatches: List[Dict[str, Any]],
+	preview_max_side: int = 256,
+	full_res: Sequence[int] = (),
+	columns: int = 4,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[Dict[str, float]]]:
+	"""Render many paint swatches from one decode, sharing the HSV conversion.
+
+	Each swatch is ``{"dh", "ds", "dv"}`` or ``{"color": "#rrggbb"}``. Returns
+	the contact sheet, the ``(S, ph, pw, 3)`` previews, full-resolution renders
+	for the ``full_res`` swatch indices and the resolved ``dh/ds/dv`` per swatch.
+	"""
+	if mask.ndim == 3:
+		mask = cv.cvtColor(mask, cv.COLOR_BGR2GRAY)
+	h, w = image_bgr.shape[:2]
+	scale = min(1.0, preview_max_side / float(max(h, w)))
+	size = (max(1, round(w * scale)), max(1, round(h * scale)))
+	small = cv.resize(image_bgr, size, interpolation=cv.INTER_AREA) if scale < 1.0 else image_bgr
+	small_mask = cv.resize((mask > 0).astype(np.uint8) * 255, size, interpolation=cv.INTER_AREA) > 127
+
+	small_hsv_px = cv.cvtColor(small, cv.COLOR_BGR2HSV).reshape(-1, 3)[np.flatnonzero(small_mask)].astype(np.float32)
+	params = np.array([swatch_params(s, small_hsv_px) for s in swatches], dtype=np.float32).reshape(-1, 3)
+
+	previews = _render(small, small_mask, params)
+	sheet = _contact_sheet(previews, columns)
+	# The sheet is what the user is waiting for; full-res renders can follow
+	progress.report("palette", done=len(swatches), total=len(swatches), preview=sheet)
+	if full_res:
+		renders = _render(image_bgr, mask > 0, params[list(full_res)])
+	else:
+		renders = np.zeros((0, h, w, 3), np.uint8)
+	resolved = [{"dh": float(p[0]), "ds": float(p[1]), "dv": float(p[2])} for p in params]
+	return sheet, previews, renders, resolved
@@ -1,8 +1,12 @@
 import cv2 as cv
 import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
 
+from . import progress
 
-def grabcut_segment(image_bgr: np.ndarray, rect=None) -> np.ndarray:
+
+def grabcut_state(image_bgr: np.ndarray, rect=None, iterations: int = 5) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+	"""Full GrabCut run returning the 4-state mask and the bgd/fgd GMM models."""
 	h, w = image_bgr.shape[:2]
 	if rect is None:
 		rect = (int(0.05 * w), int(0.1 * h), int(0.9 * w), int(0.8 * h))
@@ -10,9 +14,93 @@ def grabcut_segment(image_bgr: np.ndarray, rect=None) -> np.ndarray:
 	bgd = np.zeros((1, 65), np.float64)
 	fgd = np.zeros((1, 65), np.float64)
 	try:
-		cv.grabCut(image_bgr, mask, rect, bgd, fgd, 5, cv.GC_INIT_WITH_RECT)
+		if not progress.active():
+			cv.grabCut(image_bgr, mask, rect, bgd, fgd, iterations, cv.GC_INIT_WITH_RECT)
+			return mask, bgd, fgd
+		# Someone is watching: one iteration per call (resuming the models) so each can be reported
+		for i in range(iterations):
+			mode = cv.GC_INIT_WITH_RECT if i == 0 else cv.GC_EVAL
+			cv.grabCut(image_bgr, mask, rect, bgd, fgd, 1, mode)
+			progress.report("grabcut", done=i + 1, total=iterations, preview=_preview(image_bgr, mask))
 	except Exception:
 		mask[:] = 1
-	result = np.where((mask == 2) | (mask == 0), 0, 255).astype(np.uint8)
-	return result
+	return mask, bgd, fgd
+
+
+def _preview(image_bgr: np.ndarray, state: np.ndarray) -> np.ndarray:
+	"""Low-res view of the current cut: background dimmed, foreground as is."""
+	h, w = image_bgr.shape[:2]
+	scale = min(1.0, progress.PREVIEW_MAX_SIDE / float(max(h, w)))
+	size = (max(1, int(w * scale)), max(1, int(h * scale)))
+	small = cv.resize(image_bgr, size, interpolation=cv.INTER_AREA)
+	fg = cv.resize(state_to_mask(state), size, interpolation=cv.INTER_NEAREST) > 0
+	small[~fg] //= 3
+	return small
+
+
+def state_to_mask(state: np.ndarray) -> np.ndarray:
+	return np.where((state == cv.GC_BGD) | (state == cv.GC_PR_BGD), 0, 255).astype(np.uint8)
+
+
+def grabcut_segment(image_bgr: np.ndarray, rect=None) -> np.ndarray:
+	mask, _, _ = grabcut_state(image_bgr, rect)
+	return state_to_mask(mask)
 
+
+def grabcut_segment_with_state(image_bgr: np.ndarray, rect=None) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+	"""``grabcut_segment`` plus the state needed by ``grabcut_refine``: (mask, state, bgd, fgd)."""
+	state, bgd, fgd = grabcut_state(image_bgr, rect)
+	return state_to_mask(state), state, bgd, fgd
+
+
+def stroke_region(strokes: List[Dict[str, Any]], shape: Tuple[int, ...], margin: int = 48) -> Tuple[int, int, int, int]:
+	"""Bounding box ``(x0, y0, x1, y1)`` around the strokes, padded by ``margin`` plus the brush radius."""
+	h, w = shape[:2]
+	xs = [p[0] for s in strokes for p in s["points"]]
+	ys = [p[1] for s in strokes for p in s["points"]]
+	pad = margin + max(int(np.ceil(s["radius"])) for s in strokes)
+	x0, y0 = max(0, int(min(xs)) - pad), max(0, int(min(ys)) - pad)
+	x1, y1 = min(w, int(np.ceil(max(xs))) + pad + 1), min(h, int(np.ceil(max(ys))) + pad + 1)
+	return x0, y0, x1, y1
+
+
+def grabcut_refine(
+	image_bgr: np.ndarray,
+	state: np.ndarray,
+	bgd: np.ndarray,
+	fgd: np.ndarray,
+	strokes: List[Dict[str, Any]],
+	iterations: int = 1,
+	margin: int = 48,
+) -> np.ndarray:
+	"""Apply fg/bg strokes to a previous GrabCut result and re-run it locally.
+
+	``strokes`` are ``{"points": [(x, y), ...], "label": "fg" | "bg", "radius": r}``.
+	Only the region around the strokes is re-cut, and when models from the
+	previous run are available they are resumed (``GC_EVAL``) instead of being
+	re-estimated. The stored models are left as they were, so a local fix does
+	not skew later refinements elsewhere. Returns ``(mask, state)``.
+	"""
+	x0, y0, x1, y1 = stroke_region(strokes, image_bgr.shape, margin)
+	new_state = np.array(state, copy=True)
+	crop = np.ascontiguousarray(new_state[y0:y1, x0:x1])
+	for stroke in strokes:
+		value = cv.GC_FGD if stroke["label"] == "fg" else cv.GC_BGD
+		thickness = max(1, int(round(stroke["radius"] * 2)))
+		pts = np.array([(p[0] - x0, p[1] - y0) for p in stroke["points"]], dtype=np.int32)
+		if len(pts) == 1:
+			cv.circle(crop, tuple(int(v) for v in pts[0]), thickness // 2, int(value), -1)
+		else:
+			cv.polylines(crop, [pts], False, int(value), thickness)
+
+	image_crop = np.ascontiguousarray(image_bgr[y0:y1, x0:x1])
+	has_models = bool(np.any(bgd)) and bool(np.any(fgd))
+	bgd_run, fgd_run = np.array(bgd, np.float64).reshape(1, 65), np.array(fgd, np.float64).reshape(1, 65)
+	try:
+		mode = cv.GC_EVAL if has_models else cv.GC_INIT_WITH_MASK
+		cv.grabCut(image_crop, crop, None, bgd_run, fgd_run, iterations, mode)
+	except Exception:
+		# Region without both fg and bg samples: keep the hard stroke labels only
+		pass
+	new_state[y0:y1, x0:x1] = crop
+	return state_to_mask(new_state), new_state
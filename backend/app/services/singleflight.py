@@ -0,0 +1,74 @@
+"""Coalescing of identical concurrent requests.
+
+Identical in-flight calls (same key) share one computation and one result; a
+short-lived memo also answers near-simultaneous repeats (double clicks,
+client retries) without recomputing. Both are per process.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+
+MEMO_TTL_SECONDS = float(os.getenv("OPS_MEMO_TTL_SECONDS", "10"))
+_MEMO_MAX_ENTRIES = 512
+
+
+def op_key(op: str, paths: Iterable[Optional[str]], params: Dict[str, Any]) -> str:
+	"""Key for an op over input files: paths plus their mtime/size, and the parameters."""
+	files = []
+	for path in paths:
+		if not path:
+			continue
+		try:
+			st = os.stat(path)
+			files.append((path, st.st_mtime_ns, st.st_size))
+		except OSError:
+			files.append((path, None, None))
+	raw = json.dumps([op, files, params], sort_keys=True, default=str)
+	return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+	def __init__(self, memo_ttl: float = MEMO_TTL_SECONDS):
+		self.memo_ttl = memo_ttl
+		self._inflight: Dict[str, "asyncio.Future[Any]"] = {}
+		self._memo: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+	def _memo_get(self, key: str) -> Tuple[bool, Any]:
+		entry = self._memo.get(key)
+		if entry is None:
+			return False, None
+		if entry[0] < time.monotonic():
+			del self._memo[key]
+			return False, None
+		return True, entry[1]
+
+	def _finish(self, key: str, task: "asyncio.Future[Any]") -> None:
+		self._inflight.pop(key, None)
+		if task.cancelled() or task.exception() is not None:
+			return
+		if self.memo_ttl > 0:
+			self._memo[key] = (time.monotonic() + self.memo_ttl, task.result())
+			self._memo.move_to_end(key)
+			while len(self._memo) > _MEMO_MAX_ENTRIES:
+				self._memo.popitem(last=False)
+
+	async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+		hit, result = self._memo_get(key)
+		if hit:
+			return result
+		task = self._inflight.get(key)
+		if task is None:
+			# The computation runs as its own task so one caller going away does
+			# not cancel it for the others waiting on the same key
+			task = asyncio.ensure_future(fn())
+			self._inflight[key] = task
+			task.add_done_callback(lambda t: self._finish(key, t))
+		return await asyncio.shield(task)
+
+
+ops_flight = SingleFlight()
@@ -0,0 +1,97 @@
+import os
+import shutil
+import time
+from typing import Any, Dict, Iterator, Optional
+
+from .storage import BASE_MEDIA_DIR, read_image_bgr_or_bgra
+
+
+SHARE_SUBDIR = "share"
+# Long side of the display derivatives rendered for public share pages
+DISPLAY_MAX_SIDE = int(os.getenv("SHARE_DISPLAY_MAX_SIDE", "1600"))
+WEBP_QUALITY = int(os.getenv("SHARE_WEBP_QUALITY", "85"))
+# Superseded snapshot versions stay readable this long, so manifests still held by
+# HTTP caches (max-age + stale-while-revalidate) keep resolving
+SNAPSHOT_GRACE_SECONDS = float(os.getenv("SHARE_SNAPSHOT_GRACE_HOURS", "25")) * 3600
+
+
+def snapshot_dir(slug: str, version: Optional[str] = None) -> str:
+	"""Directory of one share; each publish renders into its own ``version`` below it."""
+	root = os.path.join(BASE_MEDIA_DIR, SHARE_SUBDIR, slug)
+	return os.path.join(root, version) if version else root
+
+
+def new_version() -> str:
+	return f"{time.time_ns():x}"
+
+
+def render_display_webp(src_path: str, slug: str, name: str, version: Optional[str] = None) -> Optional[Dict[str, Any]]:
+	"""Write a display-size WebP derivative of ``src_path`` into the snapshot of ``slug``."""
+	import cv2 as cv
+
+	img = read_image_bgr_or_bgra(src_path, keep_alpha=True)
+	if img is None:
+		return None
+	h, w = img.shape[:2]
+	scale = min(1.0, DISPLAY_MAX_SIDE / float(max(h, w)))
+	if scale < 1.0:
+		img = cv.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv.INTER_AREA)
+	out_dir = snapshot_dir(slug, version)
+	os.makedirs(out_dir, exist_ok=True)
+	out_path = os.path.join(out_dir, f"{name}.webp")
+	cv.imwrite(out_path, img, [cv.IMWRITE_WEBP_QUALITY, WEBP_QUALITY])
+	return {"display_url": out_path.replace("\\", "/"), "display_width": img.shape[1], "display_height": img.shape[0]}
+
+
+def remove_snapshot(slug: str, version: Optional[str] = None) -> None:
+	shutil.rmtree(snapshot_dir(slug, version), ignore_errors=True)
+
+
+def stale_versions(slug: str, current: Optional[str], grace_seconds: float = SNAPSHOT_GRACE_SECONDS, now: Optional[float] = None) -> Iterator[str]:
+	"""Entries of ``slug`` other than the ``current`` version, older than the grace period.
+
+	Files directly in the share directory predate versioned snapshots and are
+	stale once a versioned one is live.
+	"""
+	if current is None:
+		return
+	now = time.time() if now is None else now
+	try:
+		entries = list(os.scandir(snapshot_dir(slug)))
+	except FileNotFoundError:
+		return
+	for entry in entries:
+		if entry.name != current and now - entry.stat().st_mtime >= grace_seconds:
+			yield entry.path
+
+
+def path_bytes(path: str) -> int:
+	if not os.path.isdir(path):
+		try:
+			return os.path.getsize(path)
+		except FileNotFoundError:
+			return 0
+	total = 0
+	for dirpath, _, filenames in os.walk(path):
+		for name in filenames:
+			try:
+				total += os.path.getsize(os.path.join(dirpath, name))
+			except FileNotFoundError:
+				pass
+	return total
+
+
+def remove_path(path: str) -> None:
+	"""Delete a snapshot file or (version) directory."""
+	if os.path.isdir(path):
+		shutil.rmtree(path, ignore_errors=True)
+		return
+	try:
+		os.remove(path)
+	except FileNotFoundError:
+		pass
+
+
+def prune_versions(slug: str, current: Optional[str], grace_seconds: float = SNAPSHOT_GRACE_SECONDS) -> None:
+	for path in stale_versions(slug, current, grace_seconds):
+		remove_path(path)
@@ -1,15 +1,34 @@
 import os
 import uuid
-from typing import Tuple, Dict, Any, Optional
+import hashlib
+from typing import TYPE_CHECKING, Tuple, Dict, Any, Optional
 import aiofiles
-import cv2 as cv
-import numpy as np
 from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+
+from . import image_store
+
+# OpenCV/NumPy are imported on first use so that processes which never touch
+# image data (auth, catalog) start without loading them.
+if TYPE_CHECKING:
+	import numpy as np
 
 
 BASE_MEDIA_DIR = os.path.join("media")
 
 
+def shard_dir(subdir: str, name: str) -> str:
+	"""Directory for ``name`` under ``subdir``, fanned out over 256 hashed shards."""
+	shard = hashlib.sha1(name.encode("utf-8")).hexdigest()[:2]
+	return os.path.join(BASE_MEDIA_DIR, subdir, shard)
+
+
+def in_media_root(path: str) -> bool:
+	"""Whether ``path`` resolves to a file under the media root (client paths may point anywhere)."""
+	root = os.path.realpath(BASE_MEDIA_DIR)
+	return os.path.realpath(path).startswith(root + os.sep)
+
+
 def ensure_path_exists(path: str) -> None:
 	dirname = os.path.dirname(path)
 	if dirname and not os.path.exists(dirname):
@@ -17,11 +36,15 @@ def ensure_path_exists(path: str) -> None:
 
 
 async def save_upload_file(file: UploadFile, subdir: str = "") -> Tuple[str, Dict[str, Any]]:
+	import cv2 as cv
+	import numpy as np
+	from .phash import image_hash, to_hex
+
 	uid = str(uuid.uuid4())
 	ext = os.path.splitext(file.filename or "upload")[-1].lower()
 	if ext not in [".jpg", ".jpeg", ".png", ".webp", ".bmp"]:
 		ext = ".png"
-	out_dir = os.path.join(BASE_MEDIA_DIR, subdir)
+	out_dir = shard_dir(subdir, uid)
 	os.makedirs(out_dir, exist_ok=True)
 	out_path = os.path.join(out_dir, f"{uid}{ext}")
 	async with aiofiles.open(out_path, "wb") as f:
@@ -29,18 +52,89 @@ async def save_upload_file(file: UploadFile, subdir: str = "") -> Tuple[str, Dic
 		await f.write(content)
 	# try to read as image to get meta
 	img = cv.imdecode(np.frombuffer(content, dtype=np.uint8), cv.IMREAD_UNCHANGED)
-	meta: Dict[str, Any] = {}
+	meta: Dict[str, Any] = {"sha256": hashlib.sha256(content).hexdigest()}
 	if img is not None:
 		h, w = img.shape[:2]
-		meta = {"width": w, "height": h, "channels": img.shape[2] if len(img.shape) == 3 else 1}
+		meta.update({"width": w, "height": h, "channels": img.shape[2] if len(img.shape) == 3 else 1})
+		# Perceptual hash for near-duplicate lookup; sha256 only catches byte-identical copies
+		meta["phash"] = to_hex(image_hash(img))
+	return out_path.replace("\\", "/"), meta
+
+
+CLIP_EXTENSIONS = (".mp4", ".mov", ".m4v", ".webm", ".avi", ".mkv")
+# Largest video upload kept on disk; the frame limit is only checked later by /ops/clip
+CLIP_MAX_BYTES = int(os.getenv("UPLOAD_CLIP_MAX_MB", "512")) * 1024 * 1024
+_UPLOAD_CHUNK_BYTES = 1 << 20
+
+
+class UploadTooLarge(ValueError):
+	pass
+
+
+def probe_clip(path: str) -> Optional[Dict[str, Any]]:
+	"""``{frames, fps, width, height}`` from the container header, ``None`` if unreadable."""
+	if not os.path.exists(path):
+		return None
+	import cv2 as cv
+
+	cap = cv.VideoCapture(path)
+	try:
+		width, height = int(cap.get(cv.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv.CAP_PROP_FRAME_HEIGHT))
+		if not cap.isOpened() or width <= 0 or height <= 0:
+			return None
+		return {
+			"frames": int(cap.get(cv.CAP_PROP_FRAME_COUNT)),
+			"fps": round(float(cap.get(cv.CAP_PROP_FPS)), 3),
+			"width": width,
+			"height": height,
+		}
+	finally:
+		cap.release()
+
+
+async def save_upload_clip(file: UploadFile, subdir: str = "clips") -> Tuple[str, Optional[Dict[str, Any]]]:
+	"""Stream a video upload to disk in chunks (clips are too big to buffer) and probe it.
+
+	Raises ``UploadTooLarge`` past ``CLIP_MAX_BYTES``; the partial file is removed.
+	"""
+	uid = str(uuid.uuid4())
+	ext = os.path.splitext(file.filename or "upload")[-1].lower()
+	if ext not in CLIP_EXTENSIONS:
+		ext = ".mp4"
+	out_dir = shard_dir(subdir, uid)
+	os.makedirs(out_dir, exist_ok=True)
+	out_path = os.path.join(out_dir, f"{uid}{ext}")
+	written = 0
+	try:
+		async with aiofiles.open(out_path, "wb") as f:
+			while True:
+				chunk = await file.read(_UPLOAD_CHUNK_BYTES)
+				if not chunk:
+					break
+				written += len(chunk)
+				if written > CLIP_MAX_BYTES:
+					raise UploadTooLarge(f"video is larger than {CLIP_MAX_BYTES // (1024 * 1024)} MB")
+				await f.write(chunk)
+	except BaseException:
+		if os.path.exists(out_path):
+			os.remove(out_path)
+		raise
+	meta = await run_in_threadpool(probe_clip, out_path)
+	if meta is None:
+		os.remove(out_path)
 	return out_path.replace("\\", "/"), meta
 
 
-def read_image_bgr_or_bgra(path: str, keep_alpha: bool = False, prefer_gray: bool = False) -> Optional[np.ndarray]:
+def read_image_bgr_or_bgra(path: str, keep_alpha: bool = False, prefer_gray: bool = False) -> Optional["np.ndarray"]:
 	if not os.path.exists(path):
 		return None
-	flag = cv.IMREAD_UNCHANGED
-	img = cv.imread(path, flag)
+	import cv2 as cv
+
+	# Decoded pixels come from the shared store (read-only mapping) when enabled
+	if image_store.STORE_ENABLED:
+		img = image_store.load(path)
+	else:
+		img = cv.imread(path, cv.IMREAD_UNCHANGED)
 	if img is None:
 		return None
 	if prefer_gray:
@@ -56,11 +150,13 @@ def read_image_bgr_or_bgra(path: str, keep_alpha: bool = False, prefer_gray: boo
 	return img
 
 
-def save_image_np(image: np.ndarray, subdir: str = "", filename: Optional[str] = None, force_gray: bool = False) -> str:
-	out_dir = os.path.join(BASE_MEDIA_DIR, subdir)
-	os.makedirs(out_dir, exist_ok=True)
+def save_image_np(image: "np.ndarray", subdir: str = "", filename: Optional[str] = None, force_gray: bool = False, ext: str = ".png") -> str:
+	import cv2 as cv
+
 	uid = filename or str(uuid.uuid4())
-	path = os.path.join(out_dir, f"{uid}.png")
+	out_dir = shard_dir(subdir, uid)
+	os.makedirs(out_dir, exist_ok=True)
+	path = os.path.join(out_dir, f"{uid}{ext}")
 	if force_gray and image.ndim == 3:
 		image = cv.cvtColor(image, cv.COLOR_BGR2GRAY)
 	cv.imwrite(path, image)
@@ -0,0 +1,47 @@
+"""Strip-wise execution for images too large to process in one pass.
+
+Ops that would otherwise materialise several full-frame float copies process
+the image in horizontal strips sized from a per-request memory budget and
+write each strip straight into a preallocated output (optionally a
+memory-mapped file).
+"""
+import os
+from typing import TYPE_CHECKING, Iterator, Optional, Tuple
+
+if TYPE_CHECKING:
+	import numpy as np
+
+
+# Frames above this many pixels are processed in strips
+TILED_MIN_PIXELS = int(os.getenv("TILED_MIN_PIXELS", str(16_000_000)))
+# Transient working memory allowed per request while tiling
+TILE_MEMORY_BUDGET_BYTES = int(os.getenv("TILE_MEMORY_BUDGET_MB", "256")) * 1024 * 1024
+
+
+class MemoryBudgetExceeded(Exception):
+	pass
+
+
+def should_tile(shape: Tuple[int, ...]) -> bool:
+	return shape[0] * shape[1] > TILED_MIN_PIXELS
+
+
+def strip_height(width: int, bytes_per_pixel: int, budget: int = TILE_MEMORY_BUDGET_BYTES) -> int:
+	rows = budget // max(width * bytes_per_pixel, 1)
+	if rows < 1:
+		raise MemoryBudgetExceeded(f"a single {width}px row needs {width * bytes_per_pixel} bytes, budget is {budget}")
+	return int(rows)
+
+
+def iter_strips(height: int, rows: int) -> Iterator[Tuple[int, int]]:
+	for y0 in range(0, height, rows):
+		yield y0, min(y0 + rows, height)
+
+
+def allocate_output(shape: Tuple[int, ...], dtype, out_path: Optional[str] = None) -> "np.ndarray":
+	"""Preallocated output frame, backed by a ``.npy`` file when ``out_path`` is given."""
+	import numpy as np
+
+	if out_path is None:
+		return np.empty(shape, dtype=dtype)
+	return np.lib.format.open_memmap(out_path, mode="w+", dtype=dtype, shape=shape)
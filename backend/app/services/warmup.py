@@ -0,0 +1,63 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+logger = logging.getLogger(__name__)
+
+_ready = threading.Event()
+_lock = threading.Lock()
+_thread: Optional[threading.Thread] = None
+_status: Dict[str, Any] = {"warmup_ms": None, "error": None}
+
+
+def _warm() -> None:
+	start = time.perf_counter()
+	try:
+		# Pull in the heavy image stack and touch the code paths that lazily
+		# initialise (codec tables, colour conversion LUTs, bcrypt backend).
+		import numpy as np
+		import cv2 as cv
+		from . import segment, recolor, overlay  # noqa: F401
+		from .auth import get_pwd_context
+
+		img = np.zeros((64, 64, 3), np.uint8)
+		cv.cvtColor(img, cv.COLOR_BGR2HSV)
+		cv.imencode(".png", img)
+		cv.imencode(".webp", img)
+		get_pwd_context()
+
+		from . import executor
+		executor.prestart()
+	except Exception as exc:  # a failed warmup must not keep the worker out of rotation
+		logger.exception("worker warmup failed")
+		_status["error"] = str(exc)
+	finally:
+		_status["warmup_ms"] = round((time.perf_counter() - start) * 1000, 1)
+		_ready.set()
+
+
+def start_background_warmup() -> None:
+	global _thread
+	with _lock:
+		if _thread is not None:
+			return
+		_thread = threading.Thread(target=_warm, name="warmup", daemon=True)
+		_thread.start()
+
+
+def mark_ready() -> None:
+	_ready.set()
+
+
+def is_ready() -> bool:
+	return _ready.is_set()
+
+
+def wait_ready(timeout: Optional[float] = None) -> bool:
+	return _ready.wait(timeout)
+
+
+def status() -> Dict[str, Any]:
+	return dict(_status)
@@ -0,0 +1,53 @@
+"""Latency of the wheel / vehicle detection stage.
+
+Run from the ``backend`` directory::
+
+    python -m benchmarks.detect --runs 10
+
+Uses a synthetic side-view car (body plus two wheels) at several resolutions
+and reports detection latency and whether both wheels were found.
+"""
+import argparse
+import statistics
+import time
+
+import cv2 as cv
+import numpy as np
+
+from app.services.detect import detect_vehicle
+
+
+def _synthetic_car(width: int, height: int) -> np.ndarray:
+	img = np.full((height, width, 3), (190, 195, 200), np.uint8)
+	noise = np.random.default_rng(0).integers(0, 12, img.shape, dtype=np.uint8)
+	img = cv.add(img, noise)
+	body_top, body_bottom = int(height * 0.35), int(height * 0.7)
+	cv.rectangle(img, (int(width * 0.15), body_top), (int(width * 0.85), body_bottom), (40, 40, 160), -1)
+	r = int(width * 0.08)
+	for cx in (int(width * 0.3), int(width * 0.7)):
+		cv.circle(img, (cx, body_bottom), r, (20, 20, 20), -1)
+		cv.circle(img, (cx, body_bottom), int(r * 0.6), (170, 170, 170), -1)
+	return img
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--runs", type=int, default=10)
+	args = parser.parse_args()
+
+	for width, height in ((1280, 720), (4000, 3000), (6000, 4000)):
+		img = _synthetic_car(width, height)
+		timings = []
+		for _ in range(args.runs):
+			t0 = time.perf_counter()
+			result = detect_vehicle(img)
+			timings.append((time.perf_counter() - t0) * 1000)
+		print(
+			f"{width}x{height} ({width * height / 1e6:4.1f} MP): "
+			f"median {statistics.median(timings):7.1f} ms  min {min(timings):7.1f} ms  "
+			f"wheels found {len(result['wheels'])}  rect {result['rect']}"
+		)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,61 @@
+"""Compact mask encodings vs. the PNG masks written by /ops/segment.
+
+Run from the ``backend`` directory::
+
+    python -m benchmarks.mask_codec --runs 10
+
+For a synthetic car silhouette at several resolutions, reports encoded size
+and the time to get back a boolean mask (PNG: imdecode + threshold).
+"""
+import argparse
+import statistics
+import time
+
+import cv2 as cv
+import numpy as np
+
+from app.services.maskcodec import BITS, RLE, decode_mask, encode_mask
+
+
+def _silhouette(width: int, height: int) -> np.ndarray:
+	mask = np.zeros((height, width), np.uint8)
+	body = np.array([
+		(0.08, 0.65), (0.12, 0.45), (0.3, 0.4), (0.4, 0.25), (0.65, 0.25),
+		(0.78, 0.4), (0.92, 0.45), (0.93, 0.65), (0.08, 0.65),
+	]) * (width, height)
+	cv.fillPoly(mask, [body.astype(np.int32)], 255)
+	for cx in (0.27, 0.75):
+		cv.circle(mask, (int(cx * width), int(0.65 * height)), int(0.08 * width), 255, -1)
+	return mask
+
+
+def _median_ms(fn, runs: int) -> float:
+	timings = []
+	for _ in range(runs):
+		t0 = time.perf_counter()
+		fn()
+		timings.append((time.perf_counter() - t0) * 1000)
+	return statistics.median(timings)
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--runs", type=int, default=10)
+	args = parser.parse_args()
+
+	for width, height in ((1280, 720), (4000, 3000), (6000, 4000)):
+		mask = _silhouette(width, height)
+		ok, png = cv.imencode(".png", mask)
+		png_bytes = png.tobytes()
+		rows = [("png", len(png_bytes), _median_ms(lambda: cv.imdecode(np.frombuffer(png_bytes, np.uint8), cv.IMREAD_GRAYSCALE) > 0, args.runs))]
+		for encoding in (RLE, BITS):
+			blob = encode_mask(mask, encoding)
+			assert np.array_equal(decode_mask(blob), mask > 0)
+			rows.append((encoding, len(blob), _median_ms(lambda: decode_mask(blob), args.runs)))
+		print(f"{width}x{height} ({width * height / 1e6:4.1f} MP)")
+		for name, size, ms in rows:
+			print(f"  {name:>4}: {size / 1024:9.1f} KiB  decode {ms:7.2f} ms")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,72 @@
+"""Multi-swatch palette rendering vs. one recolor call per swatch, like for like.
+
+Run from the ``backend`` directory::
+
+    python -m benchmarks.palette --swatches 1 4 16 32
+
+Two comparisons, each at a single resolution so the difference is the
+shared work and not the image size:
+
+* full resolution: ``recolor_palette`` rendering every swatch in
+  ``full_res`` vs. N ``recolor_hsv`` calls on the full frame;
+* previews: ``recolor_palette`` given the preview-size image and mask (so
+  it does not downscale) vs. N ``recolor_hsv`` calls on that same image.
+
+Encoding is left out of both sides; the palette side also builds its
+contact sheet (and, at full resolution, its previews).
+"""
+import argparse
+import time
+
+import cv2 as cv
+import numpy as np
+
+from app.services.recolor import recolor_hsv, recolor_palette
+from benchmarks.detect import _synthetic_car
+from benchmarks.mask_codec import _silhouette
+
+
+def _separate(image: np.ndarray, mask: np.ndarray, swatches) -> float:
+	t0 = time.perf_counter()
+	for sw in swatches:
+		recolor_hsv(image, mask, **sw)
+	return time.perf_counter() - t0
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--swatches", type=int, nargs="+", default=[1, 4, 16, 32])
+	parser.add_argument("--width", type=int, default=4000)
+	parser.add_argument("--height", type=int, default=3000)
+	parser.add_argument("--preview-size", type=int, default=256)
+	args = parser.parse_args()
+
+	image = _synthetic_car(args.width, args.height)
+	mask = _silhouette(args.width, args.height)
+	scale = args.preview_size / float(max(args.width, args.height))
+	size = (max(1, round(args.width * scale)), max(1, round(args.height * scale)))
+	small = cv.resize(image, size, interpolation=cv.INTER_AREA)
+	small_mask = (cv.resize(mask, size, interpolation=cv.INTER_AREA) > 127).view(np.uint8)
+
+	for count in args.swatches:
+		swatches = [{"dh": (i * 180 // count) % 180, "ds": 0.1, "dv": 0.0} for i in range(count)]
+
+		separate_full = _separate(image, mask, swatches)
+		t0 = time.perf_counter()
+		recolor_palette(image, mask, swatches, preview_max_side=args.preview_size, full_res=range(count))
+		palette_full = time.perf_counter() - t0
+
+		separate_small = _separate(small, small_mask, swatches)
+		t0 = time.perf_counter()
+		recolor_palette(small, small_mask, swatches, preview_max_side=max(size))
+		palette_small = time.perf_counter() - t0
+
+		print(
+			f"{count:3d} swatches  full-res: separate {separate_full * 1000:8.1f} ms  palette {palette_full * 1000:8.1f} ms  "
+			f"x{separate_full / palette_full:4.1f}   previews: separate {separate_small * 1000:6.1f} ms  "
+			f"palette {palette_small * 1000:6.1f} ms  x{separate_small / palette_small:4.1f}"
+		)
+
+
+if __name__ == "__main__":
+	main()
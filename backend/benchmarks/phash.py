@@ -0,0 +1,143 @@
+"""Near-duplicate lookup: perceptual-hash band index vs. scanning every hash.
+
+Run from the ``backend`` directory::
+
+    python -m benchmarks.phash --rows 1000000
+
+Real photo hashes are not uniform: dealers shoot similar cars with the same
+framing, so hashes crowd into clusters and band buckets get deep. The
+benchmark therefore hashes a few hundred rendered car photos (random body
+colour, size, position, background) and derives every stored row from one
+of them with a few flipped bits, spread over many users. Each query is a
+stored row of one user with a few more bits flipped. It reports lookup time,
+how often the candidate cap was hit, and recall of the true nearest match
+(from a brute-force scan of that user's hashes), then times the full scan
+itself. Also prints how far re-encoded and resized copies of the test car
+land from the original, and how far a different photo lands.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import cv2 as cv
+import numpy as np
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base, Image, Project, User
+from app.services import phash
+from benchmarks.detect import _synthetic_car
+
+
+def _robustness() -> None:
+	car = _synthetic_car(1600, 1000)
+	base = phash.image_hash(car)
+	_, jpeg = cv.imencode(".jpg", car, [cv.IMWRITE_JPEG_QUALITY, 60])
+	variants = {
+		"jpeg q60": cv.imdecode(jpeg, cv.IMREAD_UNCHANGED),
+		"resized 50%": cv.resize(car, (800, 500), interpolation=cv.INTER_AREA),
+		"brighter +15": cv.convertScaleAbs(car, alpha=1.0, beta=15),
+		"other photo": cv.rotate(car, cv.ROTATE_180),
+	}
+	for name, image in variants.items():
+		print(f"  {name:<24} distance {phash.distance(base, phash.image_hash(image)):2d} bits")
+
+
+def _car_photo(rng: random.Random, width: int = 320, height: int = 240) -> np.ndarray:
+	"""A dealer-style shot: one car, roughly centred, on a plain lot background."""
+	img = np.full((height, width, 3), [rng.randint(150, 220)] * 3, np.uint8)
+	img = cv.add(img, np.random.default_rng(rng.getrandbits(32)).integers(0, 20, img.shape, dtype=np.uint8))
+	cx, cy = width * rng.uniform(0.4, 0.6), height * rng.uniform(0.45, 0.6)
+	bw, bh = width * rng.uniform(0.5, 0.75), height * rng.uniform(0.2, 0.35)
+	x0, y0 = int(cx - bw / 2), int(cy - bh / 2)
+	color = tuple(rng.randint(0, 255) for _ in range(3))
+	cv.rectangle(img, (x0, y0), (int(cx + bw / 2), int(cy + bh / 2)), color, -1)
+	cv.rectangle(img, (int(x0 + bw * 0.2), int(y0 - bh * 0.45)), (int(x0 + bw * 0.75), y0), color, -1)
+	r = int(bh * rng.uniform(0.3, 0.45))
+	for fx in (0.22, 0.78):
+		cv.circle(img, (int(x0 + bw * fx), int(cy + bh / 2)), r, (20, 20, 20), -1)
+	return img
+
+
+def _flip_bits(value: int, count: int, rng: random.Random) -> int:
+	for bit in rng.sample(range(phash.HASH_BITS), count):
+		value ^= 1 << bit
+	return value
+
+
+def _brute_force_nearest(user_hashes: np.ndarray, value: int) -> int:
+	xor = user_hashes ^ np.uint64(value)
+	return int(np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1).min())
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--rows", type=int, default=200000)
+	parser.add_argument("--photos", type=int, default=500, help="Distinct rendered photos the rows are derived from")
+	parser.add_argument("--users", type=int, default=50)
+	parser.add_argument("--queries", type=int, default=200)
+	parser.add_argument("--max-distance", type=int, default=phash.NEAR_DUPLICATE_DISTANCE)
+	args = parser.parse_args()
+
+	print("hash distances:")
+	_robustness()
+
+	rng = random.Random(0)
+	bases = [phash.image_hash(_car_photo(rng)) for _ in range(args.photos)]
+	spread = [phash.distance(a, b) for a, b in zip(bases, bases[1:])]
+	print(f"{args.photos} rendered photos: median distance between neighbours {int(np.median(spread))} bits")
+
+	with tempfile.TemporaryDirectory() as tmp:
+		engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+		Base.metadata.create_all(bind=engine)
+		user_hashes = []
+
+		t0 = time.perf_counter()
+		with engine.begin() as conn:
+			conn.execute(insert(User), [{"id": u, "email": f"u{u}@example.com", "hashed_password": "-"} for u in range(1, args.users + 1)])
+			conn.execute(insert(Project), [{"id": u, "user_id": u, "title": "bench"} for u in range(1, args.users + 1)])
+			batch = []
+			for i in range(args.rows):
+				value = _flip_bits(rng.choice(bases), rng.randint(0, 8), rng)
+				user = 1 + i % args.users
+				if user == 1:
+					user_hashes.append(value)
+				batch.append({"project_id": user, "url": f"media/images/{i}.jpg", **phash.columns(value)})
+				if len(batch) == 50000:
+					conn.execute(insert(Image), batch)
+					batch = []
+			if batch:
+				conn.execute(insert(Image), batch)
+		print(f"inserted {args.rows} rows for {args.users} users in {time.perf_counter() - t0:.1f} s")
+
+		stored = np.array(user_hashes, dtype=np.uint64)
+		queries = [_flip_bits(rng.choice(user_hashes), rng.randint(0, 3), rng) for _ in range(args.queries)]
+		db = sessionmaker(bind=engine)()
+		t0 = time.perf_counter()
+		results = [phash.find_similar(db, value, 1, args.max_distance, limit=1) for value in queries]
+		indexed_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+		truncated = sum(r.truncated for r in results)
+		exact = sum(
+			1 for value, r in zip(queries, results)
+			if r.matches and r.matches[0][1] == _brute_force_nearest(stored, value)
+		)
+		print(
+			f"band index: {indexed_ms:.2f} ms/query, nearest match found {exact}/{len(queries)}, "
+			f"candidate cap hit {truncated}/{len(queries)} (PHASH_MAX_CANDIDATES={phash.MAX_CANDIDATES})"
+		)
+
+		scan_queries = queries[:5]
+		t0 = time.perf_counter()
+		for value in scan_queries:
+			hashes = np.array([h for (h,) in db.query(Image.phash).filter(Image.project_id == 1)], dtype=np.int64).view(np.uint64)
+			_brute_force_nearest(hashes, value)
+		scan_ms = (time.perf_counter() - t0) * 1000 / len(scan_queries)
+		print(f"full scan of the user's hashes: {scan_ms:.1f} ms/query  speedup x{scan_ms / indexed_ms:.1f}")
+		db.close()
+		engine.dispose()
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,54 @@
+"""Cold-start benchmark for the API process.
+
+Run from the ``backend`` directory::
+
+    python -m benchmarks.startup --runs 5
+
+Each run uses a fresh interpreter so nothing is served from ``sys.modules``.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+
+_PROBE = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import app.main
+t1 = time.perf_counter()
+LOADED = set(sys.modules)
+from app.services import warmup
+warmup.start_background_warmup()
+warmup.wait_ready(120)
+t2 = time.perf_counter()
+print(json.dumps({
+	"import_ms": (t1 - t0) * 1000,
+	"warmup_ms": (t2 - t1) * 1000,
+	"heavy_loaded_at_import": sorted(
+		m for m in ("cv2", "numpy", "jose", "passlib") if m in LOADED
+	),
+}))
+"""
+
+
+def _run_once() -> dict:
+	out = subprocess.run([sys.executable, "-c", _PROBE], capture_output=True, text=True, check=True)
+	return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--runs", type=int, default=5)
+	args = parser.parse_args()
+
+	results = [_run_once() for _ in range(args.runs)]
+	for key in ("import_ms", "warmup_ms"):
+		values = [r[key] for r in results]
+		print(f"{key:>10}: median {statistics.median(values):8.1f}  min {min(values):8.1f}  max {max(values):8.1f}")
+	print(f"heavy modules loaded by `import app.main`: {results[0]['heavy_loaded_at_import'] or 'none'}")
+
+
+if __name__ == "__main__":
+	main()
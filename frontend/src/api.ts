@@ -62,6 +62,30 @@ export async function getProject(projectId: number, token: string) {
 	return res.json();
 }
 
+export async function exportProject(projectId: number, token: string) {
+	const res = await fetch(`${API_BASE}/api/v1/projects/${projectId}/export`, {
+		headers: { Authorization: `Bearer ${token}` },
+	});
+	if (!res.ok) throw new Error("export project failed");
+	return res.blob();
+}
+
+export async function importProject(file: File, token: string, title?: string) {
+	const form = new FormData();
+	form.append("file", file);
+	if (title) {
+		form.append("title", title);
+	}
+	
+	const res = await fetch(`${API_BASE}/api/v1/projects/import`, {
+		method: "POST",
+		body: form,
+		headers: { Authorization: `Bearer ${token}` },
+	});
+	if (!res.ok) throw new Error("import project failed");
+	return res.json();
+}
+
 // Image functions
 export async function uploadImage(file: File, projectId?: number, token?: string) {
 	const form = new FormData();
@@ -84,13 +108,82 @@ export async function uploadImage(file: File, projectId?: number, token?: string
 	return res.json();
 }
 
-export async function segment(image_path: string, token?: string) {
+export async function getSimilarImages(imageId: number, token: string, maxDistance?: number) {
+	const params = new URLSearchParams();
+	if (maxDistance !== undefined) params.set("max_distance", maxDistance.toString());
+	const res = await fetch(`${API_BASE}/api/v1/images/${imageId}/similar?${params}`, {
+		headers: { Authorization: `Bearer ${token}` },
+	});
+	if (!res.ok) throw new Error("similar image lookup failed");
+	return res.json();
+}
+
+export async function uploadClip(file: File, token: string) {
+	const form = new FormData();
+	form.append("file", file);
+	
+	const res = await fetch(`${API_BASE}/api/v1/images/clip`, {
+		method: "POST",
+		body: form,
+		headers: { Authorization: `Bearer ${token}` },
+	});
+	if (!res.ok) throw new Error("clip upload failed");
+	return res.json();
+}
+
+export type ProgressEvent = {
+	stage: string,
+	done?: number,
+	total?: number,
+	preview?: string,
+	result?: any,
+	detail?: string,
+	final?: boolean,
+};
+
+export function newProgressId() {
+	return crypto.randomUUID();
+}
+
+function withProgress(url: string, progressId?: string) {
+	return progressId ? `${url}?progress_id=${encodeURIComponent(progressId)}` : url;
+}
+
+// Server-Sent Events over fetch, since EventSource cannot send the Authorization header.
+// Open it before submitting the op; events sent earlier are replayed.
+export async function streamProgress(progressId: string, token: string, onEvent: (event: ProgressEvent) => void, signal?: AbortSignal) {
+	const res = await fetch(`${API_BASE}/api/v1/ops/progress/${encodeURIComponent(progressId)}`, {
+		headers: { Authorization: `Bearer ${token}` },
+		signal,
+	});
+	if (!res.ok || !res.body) throw new Error("progress stream failed");
+	
+	const reader = res.body.pipeThrough(new TextDecoderStream()).getReader();
+	let buffer = "";
+	for (;;) {
+		const { value, done } = await reader.read();
+		if (done) return;
+		buffer += value;
+		let end;
+		while ((end = buffer.indexOf("\n\n")) >= 0) {
+			const block = buffer.slice(0, end);
+			buffer = buffer.slice(end + 2);
+			const data = block.split("\n").find((line) => line.startsWith("data: "));
+			if (!data) continue;
+			const event: ProgressEvent = JSON.parse(data.slice(6));
+			onEvent(event);
+			if (event.final) return;
+		}
+	}
+}
+
+export async function segment(image_path: string, token?: string, progressId?: string) {
 	const headers: Record<string, string> = { "Content-Type": "application/json" };
 	if (token) {
 		headers.Authorization = `Bearer ${token}`;
 	}
 	
-	const res = await fetch(`${API_BASE}/api/v1/ops/segment`, {
+	const res = await fetch(withProgress(`${API_BASE}/api/v1/ops/segment`, progressId), {
 		method: "POST",
 		headers,
 		body: JSON.stringify({ image_path }),
@@ -99,6 +192,38 @@ export async function segment(image_path: string, token?: string) {
 	return res.json();
 }
 
+export type Stroke = { points: Array<{x: number, y: number}>, label: "fg" | "bg", radius?: number };
+
+export async function refineSegment(maskId: number, strokes: Stroke[], token?: string) {
+	const headers: Record<string, string> = { "Content-Type": "application/json" };
+	if (token) {
+		headers.Authorization = `Bearer ${token}`;
+	}
+	
+	const res = await fetch(`${API_BASE}/api/v1/ops/segment/refine`, {
+		method: "POST",
+		headers,
+		body: JSON.stringify({ mask_id: maskId, strokes }),
+	});
+	if (!res.ok) throw new Error("refine segment failed");
+	return res.json();
+}
+
+export async function detectVehicle(image_path: string, mask_path?: string, token?: string) {
+	const headers: Record<string, string> = { "Content-Type": "application/json" };
+	if (token) {
+		headers.Authorization = `Bearer ${token}`;
+	}
+	
+	const res = await fetch(`${API_BASE}/api/v1/ops/detect`, {
+		method: "POST",
+		headers,
+		body: JSON.stringify({ image_path, mask_path }),
+	});
+	if (!res.ok) throw new Error("detect failed");
+	return res.json();
+}
+
 export async function recolor(image_path: string, mask_path: string, dh = 0, ds = 0, dv = 0, token?: string) {
 	const headers: Record<string, string> = { "Content-Type": "application/json" };
 	if (token) {
@@ -114,6 +239,38 @@ export async function recolor(image_path: string, mask_path: string, dh = 0, ds
 	return res.json();
 }
 
+export type Swatch = { color?: string, dh?: number, ds?: number, dv?: number };
+
+export async function recolorPalette(image_path: string, mask_path: string, swatches: Swatch[], full_res: number[] = [], token?: string, progressId?: string) {
+	const headers: Record<string, string> = { "Content-Type": "application/json" };
+	if (token) {
+		headers.Authorization = `Bearer ${token}`;
+	}
+	
+	const res = await fetch(withProgress(`${API_BASE}/api/v1/ops/recolor/palette`, progressId), {
+		method: "POST",
+		headers,
+		body: JSON.stringify({ image_path, mask_path, swatches, full_res }),
+	});
+	if (!res.ok) throw new Error("recolor palette failed");
+	return res.json();
+}
+
+export async function processClip(clip_path: string, recolor?: Swatch, wheel_image_path?: string, token?: string, progressId?: string) {
+	const headers: Record<string, string> = { "Content-Type": "application/json" };
+	if (token) {
+		headers.Authorization = `Bearer ${token}`;
+	}
+	
+	const res = await fetch(withProgress(`${API_BASE}/api/v1/ops/clip`, progressId), {
+		method: "POST",
+		headers,
+		body: JSON.stringify({ clip_path, recolor, wheel_image_path }),
+	});
+	if (!res.ok) throw new Error("clip processing failed");
+	return res.json();
+}
+
 export async function overlayWheel(baseImagePath: string, wheelImagePath: string, points: Array<{x: number, y: number}>, token?: string) {
 	const headers: Record<string, string> = { "Content-Type": "application/json" };
 	if (token) {
@@ -169,3 +326,18 @@ export async function shareProject(projectId: number, token: string) {
 }
 
 
+
+export async function unshareProject(projectId: number, token: string) {
+	const res = await fetch(`${API_BASE}/api/v1/share/projects/${projectId}`, {
+		method: "DELETE",
+		headers: { Authorization: `Bearer ${token}` },
+	});
+	if (!res.ok) throw new Error("unshare project failed");
+	return res.json();
+}
+
+export async function getSharedProject(slug: string) {
+	const res = await fetch(`${API_BASE}/api/v1/share/${slug}`);
+	if (!res.ok) throw new Error("get shared project failed");
+	return res.json();
+}